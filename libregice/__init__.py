@@ -27,5 +27,9 @@ from libregice.regice import RegiceClient, Regice, InvalidRegister
 from libregice.regice import Watchpoint
 from libregice.regiceclienttest import RegiceClientTest
 from libregice.regiceclienttest import RegisterSimulation, Simulation
+from libregice.regicerecorder import RegiceClientRecorder, RegiceClientReplay
 from libregice.regiceopenocd import RegiceOpenOCD
 from libregice.regicejlink import RegiceJLink
+from libregice.regiceremote import RegiceRemoteClient, RegiceServer
+from libregice.regiceasync import AsyncRegiceClient, AsyncRegiceClientAdapter
+from libregice.regiceasync import AsyncRegiceOpenOCD
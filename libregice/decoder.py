@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2018 BayLibre
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    This module provides a decoder to find registers from addresses.
+
+    Bus traces and watchpoint hits only provide raw addresses. The decoder
+    keeps the registers sorted by address, and uses a binary search to find
+    the registers and fields covering an address or an address range.
+"""
+
+from bisect import bisect_left
+
+class AddressDecoder:
+    """
+        A class to find the registers and fields covering an address
+
+        :param svd: The SVD object
+    """
+    def __init__(self, svd):
+        registers = []
+        for peripheral_name in svd.peripherals:
+            peripheral = svd.peripherals[peripheral_name]
+            for register_name in peripheral.registers:
+                register = peripheral.registers[register_name]
+                fields = tuple([(field_name,
+                                 register.fields[field_name].bitOffset,
+                                 register.fields[field_name].bitWidth)
+                                for field_name in register.fields])
+                registers.append((register.address(), register.size // 8,
+                                  peripheral_name, register_name, fields))
+        registers.sort(key=lambda register: register[0])
+
+        self.starts = [register[0] for register in registers]
+        self.registers = registers
+        self.max_size = max([register[1] for register in registers] or [0])
+
+    def decode(self, address, length=1):
+        """
+            Find the registers and fields covering an address range
+
+            :param address: The first address of the range
+            :param length: The length of range, in bytes
+            :return: A list of (peripheral, register, fields) tuples, ordered
+                     by address, fields being the list of the names of fields
+                     covering the range
+        """
+        end = address + length
+        index = bisect_left(self.starts, address - self.max_size + 1)
+        result = []
+        while index < len(self.starts) and self.starts[index] < end:
+            start, size, peripheral, register, fields = self.registers[index]
+            index += 1
+            if start + size <= address:
+                continue
+
+            first_bit = max(address - start, 0) * 8
+            last_bit = (min(end, start + size) - start) * 8
+            covered = [field for field, offset, width in fields
+                       if offset < last_bit and offset + width > first_bit]
+            result.append((peripheral, register, covered))
+        return result
@@ -32,6 +32,135 @@
     This uses the regice client to perform register accesses.
 """
 
+from libregice.decoder import AddressDecoder
+from libregice.regice import InvalidField, InvalidPeripheral, InvalidRegister
+from libregice.regice import decode_fields
+from libregice.snapshot import Snapshot
+from libregice.svdcache import svd_hash
+
+def register_addresses(registers):
+    """
+        Gather the address of registers, to read them using read_list()
+
+        :param registers: A list of RegiceRegister objects
+        :return: A dictionnary with the width as key, and a list of addresses
+                 as value
+    """
+    addresses = {}
+    for register in registers:
+        if not register.size in addresses:
+            addresses[register.size] = []
+        addresses[register.size].append(register.address())
+    return addresses
+
+def prefetch_registers(client, registers):
+    """
+        Read a list of registers at once, and update their cache
+
+        This gathers the address of each register, reads them using a single
+        read_list() call and updates the cached value of each register.
+
+        :param client: The client used to read the registers
+        :param registers: A list of RegiceRegister objects
+    """
+    values = client.read_list(register_addresses(registers))
+
+    for register in registers:
+        register.cached_value = values[register.address()]
+
+def flush_registers(client, registers):
+    """
+        Write the cached value of a list of registers at once
+
+        This writes the cached value of each register using a single
+        write_list() call, and marks the registers as clean.
+
+        :param client: The client used to write the registers
+        :param registers: A list of RegiceRegister objects
+    """
+    values = {}
+    for register in registers:
+        if not register.size in values:
+            values[register.size] = {}
+        values[register.size][register.address()] = register.cached_value
+        register.dirty = False
+    if values:
+        client.write_list(values)
+
+class RegiceTransaction:
+    """
+        A context manager to group register and field writes
+
+        While the transaction is in progress, the registers are read at most
+        once and the writes are only done to the cache, so all the field
+        updates targeting the same register are merged into one value.
+        On exit, the modified registers are written, ordered by address,
+        using a single write_list() call.
+        If an exception is raised, the pending writes are discarded.
+
+        The registers are created lazily, so the transaction doesn't create
+        the registers of peripherals: it covers the registers that already
+        exist, and the ones created while it is in progress.
+
+        :param client: The client used to write the registers
+        :param peripherals: A list of RegicePeripheral objects that belong to
+                            the transaction
+    """
+    def __init__(self, client, peripherals):
+        self.client = client
+        self.peripherals = peripherals
+        self.registers = []
+        self.cache_flags = []
+
+    def __enter__(self):
+        self.registers = []
+        self.cache_flags = []
+        for peripheral in self.peripherals:
+            for register in peripheral.get_created_registers():
+                self.add(register)
+            peripheral.transactions.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for peripheral in self.peripherals:
+            peripheral.transactions.remove(self)
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            for register, flags in zip(self.registers, self.cache_flags):
+                if register.dirty or flags & RegiceObject.READ == 0:
+                    register.cached_value = None
+                register.cache_flags = flags
+                register.dirty = False
+        return False
+
+    def add(self, register):
+        """
+            Add a register to the transaction
+
+            This is called for each register created while the transaction
+            is in progress.
+
+            :param register: The RegiceRegister object
+        """
+        self.cache_flags.append(register.cache_flags)
+        self.registers.append(register)
+        if register.cache_flags & RegiceObject.READ == 0:
+            register.cached_value = None
+        register.cache_flags = RegiceObject.READ | RegiceObject.WRITE
+        register.dirty = False
+
+    def commit(self):
+        """
+            Write the modified registers to device
+
+            This writes all the registers modified since the beginning of
+            transaction, or since the last commit.
+        """
+        flush_registers(self.client, [register for register in self.registers
+                                      if register.dirty])
+
 class RegiceObject:
     """
         A class to easily manipulate a register or a field
@@ -39,16 +168,22 @@ class RegiceObject:
         Each instance could represent a peripheral, a register or a field.
         This implements many operators, to read the value of register or field,
         or update them.
+        A device may have tens of thousands of fields, so the attributes are
+        stored in slots. The leaf classes still have a __dict__ slot, so
+        users could set their own attributes on registers and fields. The
+        dictionary is only allocated on the first such attribute.
     """
+    __slots__ = ('svd', 'client', 'cached_value', 'cache_flags')
+
     DISABLED = 0
     READ = 1
     WRITE = 2
 
     def __init__(self, svd, client):
-        self.__dict__['svd'] = svd
-        self.__dict__['client'] = client
-        self.__dict__['cached_value'] = None
-        self.__dict__['cache_flags'] = self.DISABLED
+        self.svd = svd
+        self.client = client
+        self.cached_value = None
+        self.cache_flags = self.DISABLED
 
     def __int__(self):
         return self.read()
@@ -198,6 +333,8 @@ class RegiceObject:
         return self
 
     def __getattr__(self, attr):
+        if attr == 'svd':
+            raise AttributeError(attr)
         return getattr(self.svd, attr)
 
 class RegiceField(RegiceObject):
@@ -209,6 +346,8 @@ class RegiceField(RegiceObject):
         or update them.
 
     """
+    __slots__ = ('parent', '__dict__')
+
     def __init__(self, parent, svd, client):
         super(RegiceField, self).__init__(svd, client)
         self.parent = parent
@@ -238,6 +377,30 @@ class RegiceField(RegiceObject):
         cached_value = self.parent.read(force_read) & ~mask
         self.parent.write(cached_value | (value << self.bitOffset), force_write)
 
+    async def aread(self, force=False):
+        """
+            Read the value of field, using an AsyncRegiceClient
+
+            :param force: Bypass cache policy and read data from device
+            :return: The value of field
+        """
+        value = await self.parent.aread(force)
+        mask = (1 << self.bitWidth) - 1
+        return (value >> self.bitOffset) & mask
+
+    async def awrite(self, value, force_read=False, force_write=False):
+        """
+            Write a value to field, using an AsyncRegiceClient
+
+            :param value: The value to write
+            :param force_read: Bypass cache policy and read data from device
+            :param force_write: Bypass cache policy and write data to device
+        """
+        mask = ((1 << self.bitWidth) - 1) << self.bitOffset
+        cached_value = await self.parent.aread(force_read) & ~mask
+        await self.parent.awrite(cached_value | (value << self.bitOffset),
+                                 force_write)
+
     def __str__(self):
         return "{}.{}.{}".format(self.svd.parent.parent.name,
                                  self.svd.parent.name, self.name)
@@ -259,13 +422,69 @@ class RegiceRegister(RegiceObject):
         Each instance could represent a register.
         This implements many operators, to read the value of registers,
         or update them.
+        The fields are created on first access. A field whose name is also
+        the name of an attribute of register (e.g. read) could only be
+        accessed using get_field().
     """
+    __slots__ = ('dirty', 'fields_obj', '__dict__')
+
     def __init__(self, svd, client):
         super(RegiceRegister, self).__init__(svd, client)
-        for field_name in svd.fields:
-            field = svd.fields[field_name]
-            field_obj = RegiceField(self, field, client)
-            setattr(self, field_name, field_obj)
+        self.dirty = False
+        self.fields_obj = None
+
+    def __getattr__(self, attr):
+        if attr in ('svd', 'fields_obj'):
+            raise AttributeError(attr)
+        fields_obj = self.fields_obj
+        if fields_obj is not None and attr in fields_obj:
+            return fields_obj[attr]
+        if attr in self.svd.fields:
+            return self.get_field(attr)
+        return getattr(self.svd, attr)
+
+    def get_field(self, name):
+        """
+            Get a field of register
+
+            :param name: The name of field
+            :return: A RegiceField object
+            :raise InvalidField: if the register has no such field
+        """
+        fields_obj = self.fields_obj
+        if fields_obj is not None and name in fields_obj:
+            return fields_obj[name]
+        fields = self.svd.fields
+        if not name in fields:
+            raise InvalidField(str(self), name)
+        if fields_obj is None:
+            fields_obj = self.fields_obj = {}
+        field = RegiceField(self, fields[name], self.client)
+        fields_obj[name] = field
+        return field
+
+    def get_fields(self):
+        """
+            Get the fields of register
+
+            :return: A list of RegiceField objects
+        """
+        return [self.get_field(field_name) for field_name in self.svd.fields]
+
+    def decode_fields(self, values):
+        """
+            Decode the fields of many values of register at once
+
+            See libregice.regice.decode_fields() for more details.
+
+            :param values: An array of register values
+            :return: A dictionnary with the field name as key, and an array
+                     of field values
+        """
+        fields = self.svd.fields
+        return decode_fields([(field_name, fields[field_name].bitOffset,
+                               (1 << fields[field_name].bitWidth) - 1)
+                              for field_name in fields], values)
 
     def read(self, force=False):
         """
@@ -297,6 +516,42 @@ class RegiceRegister(RegiceObject):
         self.cached_value = value
         if force or self.cache_flags & self.WRITE == 0:
             self.client.write(self.svd.size, self.svd.address(), value)
+            self.dirty = False
+        else:
+            self.dirty = True
+
+    async def aread(self, force=False):
+        """
+            Read the value of register, using an AsyncRegiceClient
+
+            This is the awaitable counterpart of read(). The device must have
+            been created with an AsyncRegiceClient.
+
+            :param force: Bypass cache policy and read data from device
+            :return: The value of register
+        """
+        if force or self.cached_value is None or \
+            self.cache_flags & self.READ == 0:
+            self.cached_value = await self.client.read(self.svd.size,
+                                                       self.svd.address())
+        return self.cached_value
+
+    async def awrite(self, value, force=False):
+        """
+            Write a value to register, using an AsyncRegiceClient
+
+            This is the awaitable counterpart of write(). The device must have
+            been created with an AsyncRegiceClient.
+
+            :param value: The value to write if not None
+            :param force: Bypass cache policy and write data to device
+        """
+        self.cached_value = value
+        if force or self.cache_flags & self.WRITE == 0:
+            await self.client.write(self.svd.size, self.svd.address(), value)
+            self.dirty = False
+        else:
+            self.dirty = True
 
     def flush(self):
         """
@@ -304,7 +559,7 @@ class RegiceRegister(RegiceObject):
 
             This forces to write cached value to register.
         """
-        self.client.write(self.svd.size, self.svd.address(), self.cached_value)
+        flush_registers(self.client, [self])
 
     def __str__(self):
         return "{}.{}".format(self.svd.parent.name, self.name)
@@ -320,18 +575,108 @@ class RegiceRegister(RegiceObject):
 class RegicePeripheral:
     """
         A class derived from RegiceObject, to manipulate a peripheral
+
+        The registers are created on first access. As before, a register
+        whose name is also the name of a method (e.g. flush) hides it. A
+        register whose name is also the name of an instance attribute (e.g.
+        svd) could only be accessed using get_register().
     """
     def __init__(self, svd, client):
         self.svd = svd
         self.client = client
-        for register_name in svd.registers:
-            register = svd.registers[register_name]
-            register_obj = RegiceRegister(register, client)
-            setattr(self, register_name, register_obj)
+        self.transactions = []
+        self.registers_obj = {}
+        for register_name in set(dir(type(self))).intersection(
+                svd.registers):
+            self.__dict__[register_name] = self.get_register(register_name)
 
     def __getattr__(self, attr):
+        if attr in ('svd', 'transactions', 'registers_obj'):
+            raise AttributeError(attr)
+        if attr in self.svd.registers:
+            return self.get_register(attr)
         return getattr(self.svd, attr)
 
+    def get_register(self, name):
+        """
+            Get a register of peripheral
+
+            :param name: The name of register
+            :return: A RegiceRegister object
+            :raise InvalidRegister: if the peripheral has no such register
+        """
+        if name in self.registers_obj:
+            return self.registers_obj[name]
+        registers = self.svd.registers
+        if not name in registers:
+            raise InvalidRegister(self.svd.name, name)
+        register = RegiceRegister(registers[name], self.client)
+        self.registers_obj[name] = register
+        if not name in self.__dict__:
+            self.__dict__[name] = register
+        for transaction in self.transactions:
+            transaction.add(register)
+        return register
+
+    def get_registers(self):
+        """
+            Get the registers of peripheral
+
+            :return: A list of RegiceRegister objects
+        """
+        return [self.get_register(register_name)
+                for register_name in self.svd.registers]
+
+    def get_created_registers(self):
+        """
+            Get the registers of peripheral that have already been created
+
+            :return: A list of RegiceRegister objects
+        """
+        return list(self.registers_obj.values())
+
+    def flush(self):
+        """
+            Flush the cache of peripheral's registers
+
+            This writes the cached value of the registers modified while the
+            write cache was enabled, using a single write_list() call.
+        """
+        flush_registers(self.client, [register
+                                      for register in self.get_registers()
+                                      if register.dirty])
+
+    def restore(self, values):
+        """
+            Restore the value of peripheral's registers
+
+            This writes a saved set of registers using a single write_list()
+            call.
+
+            :param values: A dictionnary of values to write, with the register
+                           name used as key
+        """
+        registers = []
+        for register_name in values:
+            if not register_name in self.svd.registers:
+                raise InvalidRegister(self.svd.name, register_name)
+            register = self.get_register(register_name)
+            register.cached_value = values[register_name]
+            registers.append(register)
+        flush_registers(self.client, registers)
+
+    def transaction(self):
+        """
+            Start a transaction on peripheral's registers
+
+            This returns a context manager that groups the writes to the
+            registers of peripheral, and writes them at once on exit.
+            See RegiceTransaction for more details.
+
+            :return: A RegiceTransaction object
+        """
+        return RegiceTransaction(self.client, [self])
+
     def cache_configure(self, flags):
         """
             Configure caching for peripheral's registers
@@ -342,7 +687,7 @@ class RegicePeripheral:
                           RegiceObject.READ, RegiceObject.WRITE
         """
         for register_name in self.svd.registers:
-            register = getattr(self, register_name)
+            register = self.get_register(register_name)
             register.cache_flags = flags
 
     def cache_prefetch(self):
@@ -354,17 +699,7 @@ class RegicePeripheral:
             values to perform many read operations on registers without
             performance hit.
         """
-        addresses = {}
-        for register_name in self.svd.registers:
-            register = self.svd.registers[register_name]
-            if not register.size in addresses:
-                addresses[register.size] = []
-            addresses[register.size].append(register.address())
-        values = self.client.read_list(addresses)
-
-        for register_name in self.svd.registers:
-            register = getattr(self, register_name)
-            register.cached_value = values[register.address()]
+        prefetch_registers(self.client, self.get_registers())
 
 class Device:
     """
@@ -374,15 +709,51 @@ class Device:
         some drivers (e.g clock).
         This provides some facilities to manipulate registers directly,
         or via drivers.
+        The peripherals are created on first access. As before, a peripheral
+        whose name is also the name of a method (e.g. restore) hides it. A
+        peripheral whose name is also the name of an instance attribute (e.g.
+        svd) could only be accessed using get_peripheral().
     """
     def __init__(self, svd, client):
 #        self.drivers = {'clock': True}
         self.name = svd.name
         self.svd = svd
         self.client = client
-        self.regice_init()
+        self.decoder = None
+        self.digest = None
+        self.peripherals_obj = {}
+        for peripheral_name in set(dir(type(self))).intersection(
+                svd.peripherals):
+            self.__dict__[peripheral_name] = self.get_peripheral(
+                peripheral_name)
 #        self.device_init()
 
+    def __getattr__(self, attr):
+        if attr in ('svd', 'peripherals_obj'):
+            raise AttributeError(attr)
+        if attr in self.svd.peripherals:
+            return self.get_peripheral(attr)
+        raise AttributeError(attr)
+
+    def get_peripheral(self, name):
+        """
+            Get a peripheral of device
+
+            :param name: The name of peripheral
+            :return: A RegicePeripheral object
+            :raise InvalidPeripheral: if the device has no such peripheral
+        """
+        if name in self.peripherals_obj:
+            return self.peripherals_obj[name]
+        peripherals = self.svd.peripherals
+        if not name in peripherals:
+            raise InvalidPeripheral(name)
+        peripheral = RegicePeripheral(peripherals[name], self.client)
+        self.peripherals_obj[name] = peripheral
+        if not name in self.__dict__:
+            self.__dict__[name] = peripheral
+        return peripheral
+
     def device_init(self):
         """
             Initialize the device
@@ -400,10 +771,157 @@ class Device:
         """
             Initialize regice
 
-            This populate the device with a tree of peripherals, registers and
-            fields.
+            The tree of peripherals, registers and fields is built lazily:
+            each object is created on first access. This populates the
+            whole tree at once.
+        """
+        for register in self.get_registers():
+            register.get_fields()
+
+    def decode(self, address, length=1):
+        """
+            Find the registers and fields covering an address range
+
+            See AddressDecoder.decode().
+
+            :param address: The first address of the range
+            :param length: The length of range, in bytes
+            :return: A list of (RegiceRegister, [RegiceField]) tuples, ordered
+                     by address
+        """
+        if self.decoder is None:
+            self.decoder = AddressDecoder(self.svd)
+        result = []
+        for peripheral, register, fields in self.decoder.decode(address,
+                                                                length):
+            register = self.get_peripheral(peripheral).get_register(register)
+            result.append((register, [register.get_field(field)
+                                      for field in fields]))
+        return result
+
+    def get_peripherals(self):
+        """
+            Get the peripherals of device
+
+            :return: A list of RegicePeripheral objects
+        """
+        return [self.get_peripheral(peripheral_name)
+                for peripheral_name in self.svd.peripherals]
+
+    def cache_prefetch(self, peripherals=None):
+        """
+            Prefetch the content of peripherals' registers to cache
+
+            This reads the registers of all the selected peripherals using a
+            single read_list() call, and updates the cache.
+            Unlike calling RegicePeripheral.cache_prefetch() for each
+            peripheral, the cpu is only halted once, which gives a coherent
+            snapshot of the device.
+
+            :param peripherals: A list of peripheral names. If None, prefetch
+                                all the peripherals of the device.
+        """
+        prefetch_registers(self.client, self.get_registers(peripherals))
+
+    async def acache_prefetch(self, peripherals=None):
+        """
+            Prefetch the content of peripherals' registers to cache
+
+            This is the awaitable counterpart of cache_prefetch(). The device
+            must have been created with an AsyncRegiceClient.
+
+            :param peripherals: A list of peripheral names. If None, prefetch
+                                all the peripherals of the device.
+        """
+        registers = self.get_registers(peripherals)
+        values = await self.client.read_list(register_addresses(registers))
+
+        for register in registers:
+            register.cached_value = values[register.address()]
+
+    def get_registers(self, peripherals=None):
+        """
+            Get the registers of one or more peripherals
+
+            :param peripherals: A list of peripheral names. If None, return
+                                the registers of all the peripherals.
+            :return: A list of RegiceRegister objects
+        """
+        if peripherals is None:
+            peripherals = self.svd.peripherals
+        registers = []
+        for peripheral_name in peripherals:
+            registers += self.get_peripheral(peripheral_name).get_registers()
+        return registers
+
+    def transaction(self, peripherals=None):
+        """
+            Start a transaction on device's registers
+
+            This returns a context manager that groups the writes to the
+            registers, and writes them at once on exit.
+            See RegiceTransaction for more details.
+
+            :param peripherals: A list of peripheral names. If None, the
+                                transaction covers all the peripherals.
+            :return: A RegiceTransaction object
+        """
+        if peripherals is None:
+            peripherals = self.svd.peripherals
+        return RegiceTransaction(self.client,
+                                 [self.get_peripheral(peripheral_name)
+                                  for peripheral_name in peripherals])
+
+    def get_digest(self):
+        """
+            Return the hash of SVD tree
+
+            :return: The hash, as a 32 bytes digest
+        """
+        if self.digest is None:
+            self.digest = svd_hash(self.svd)
+        return self.digest
+
+    def snapshot(self, peripherals=None):
+        """
+            Take a snapshot of device's registers
+
+            This reads the registers of all the selected peripherals using a
+            single read_list() call. The write-only registers are skipped.
+
+            :param peripherals: A list of peripheral names. If None, take a
+                                snapshot of all the peripherals.
+            :return: A Snapshot object
+        """
+        registers = [register for register in self.get_registers(peripherals)
+                     if getattr(register.svd, 'access', None) != 'write-only']
+        registers.sort(key=lambda register: register.address())
+        values = self.client.read_list(register_addresses(registers))
+
+        return Snapshot(self.get_digest(),
+                        [str(register) for register in registers],
+                        [register.address() for register in registers],
+                        [register.size for register in registers],
+                        [values[register.address()] for register in registers],
+                        svd=self.svd)
+
+    def restore(self, snapshot):
+        """
+            Restore the registers saved in a snapshot
+
+            This writes the writable registers of snapshot using a single
+            write_list() call. The read-only registers are skipped.
+
+            :param snapshot: The Snapshot object to restore
         """
-        for peripheral_name in self.svd.peripherals:
-            peripheral = self.svd.peripherals[peripheral_name]
-            peripheral_obj = RegicePeripheral(peripheral, self.client)
-            setattr(self, peripheral_name, peripheral_obj)
+        if snapshot.digest != self.get_digest():
+            raise ValueError("The snapshot has been taken with another SVD")
+        registers = []
+        for name, value in zip(snapshot.names, snapshot.values):
+            peripheral, register = name.split('.', 1)
+            register = self.get_peripheral(peripheral).get_register(register)
+            if getattr(register.svd, 'access', None) == 'read-only':
+                continue
+            register.cached_value = value
+            registers.append(register)
+        flush_registers(self.client, registers)
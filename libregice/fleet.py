@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2018 BayLibre
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    This module provides a way to run the same operation on many targets.
+
+    A fleet holds one Device per target, all of them sharing the same parsed
+    SVD tree, and runs an operation on all of them in parallel, using a
+    thread pool, or a process pool. The results are gathered in a table,
+    keyed by target name.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from multiprocessing.util import Finalize
+from time import monotonic
+
+from libregice.device import Device
+from libregice.regice import RegiceClient
+
+_fleet_svd = None
+_fleet_clients = {}
+
+def _fleet_close():
+    """
+        Close the clients of a worker process of the fleet
+    """
+    for client in _fleet_clients.values():
+        close = getattr(client, 'close', None)
+        if close:
+            close()
+    _fleet_clients.clear()
+
+def _fleet_init(svd):
+    """
+        Initialize a worker process of the fleet
+
+        The SVD tree is sent once per process, not once per operation.
+
+        :param svd: The SVD object
+    """
+    global _fleet_svd
+    _fleet_svd = svd
+    Finalize(None, _fleet_close, exitpriority=10)
+
+def _fleet_run(name, factory, device_class, function, args):
+    """
+        Run an operation in a worker process of the fleet
+
+        The client of each target is created on first use, and then kept
+        until the worker process exits.
+
+        :param name: The name of target
+        :param factory: A callable that returns the client of target
+        :param device_class: The class used to create the Device object
+        :param function: The operation
+        :param args: The arguments of operation
+        :return: The value returned by the operation
+    """
+    if not name in _fleet_clients:
+        _fleet_clients[name] = factory()
+    return function(device_class(_fleet_svd, _fleet_clients[name]), *args)
+
+def _read_register(device, peripheral, register):
+    return device.get_peripheral(peripheral).get_register(register).read()
+
+def _snapshot(device, peripherals):
+    # Don't send the SVD object back, the caller already has it
+    snapshot = device.snapshot(peripherals)
+    snapshot.svd = None
+    return snapshot
+
+class FleetResults(dict):
+    """
+        The results of an operation run on a fleet
+
+        This is a dictionnary with the target name as key, and the value
+        returned by the operation as value, for the targets that have
+        succeeded. The targets that have failed or timed out are listed in
+        the errors attribute, with the exception as value.
+    """
+    def __init__(self):
+        super(FleetResults, self).__init__()
+        self.errors = {}
+
+    def table(self):
+        """
+            Return the results as a table
+
+            :return: A list of (target, value, error) tuples, sorted by target
+                     name, value or error being None
+        """
+        targets = sorted(list(self.keys()) + list(self.errors.keys()))
+        return [(target, self.get(target), self.errors.get(target))
+                for target in targets]
+
+class Fleet:
+    """
+        A class to run an operation on many targets
+
+        The targets could be given as RegiceClient objects, or as callables
+        returning a RegiceClient object. The process pool requires callables
+        that could be pickled, since the clients are created in the worker
+        processes. The pool is kept until close() is called.
+        With the process pool, each target is bound to a single worker
+        process, which creates the client once and keeps it, so a probe
+        that only allows one connection is never opened twice. The process
+        pool is made of one single-worker pool per worker process.
+
+        A target that has timed out keeps running its operation, so it is
+        skipped by the next operations until the previous one completes.
+
+        :param svd: The SVD object, shared by all the targets
+        :param targets: A dictionnary with the target name as key, and the
+                        client, or a callable returning the client, as value
+        :param pool: 'thread' or 'process'
+        :param workers: The number of workers. If None, use one worker per
+                        target
+        :param device_class: The class used to create the Device objects
+    """
+    def __init__(self, svd, targets, pool='thread', workers=None,
+                 device_class=Device):
+        if not pool in ('thread', 'process'):
+            raise ValueError("Invalid pool " + pool)
+        self.svd = svd
+        self.pool = pool
+        self.workers = workers or max(len(targets), 1)
+        self.device_class = device_class
+        self.targets = dict(targets)
+        self.devices = {}
+        self.busy = {}
+        self.executors = []
+        self.affinity = {name: i % self.workers
+                         for i, name in enumerate(self.targets)}
+        if pool == 'thread':
+            for name, client in self.targets.items():
+                if not isinstance(client, RegiceClient) and callable(client):
+                    client = client()
+                self.devices[name] = device_class(svd, client)
+
+    def get_executor(self, name):
+        """
+            Return the pool that runs the operations of a target
+
+            The pools are created on first use.
+
+            :param name: The name of target
+            :return: A ThreadPoolExecutor or a ProcessPoolExecutor object
+        """
+        if not self.executors:
+            if self.pool == 'thread':
+                self.executors = [ThreadPoolExecutor(max_workers=self.workers)]
+            else:
+                self.executors = [ProcessPoolExecutor(max_workers=1,
+                                                      initializer=_fleet_init,
+                                                      initargs=(self.svd,))
+                                  for i in range(self.workers)]
+        if self.pool == 'thread':
+            return self.executors[0]
+        return self.executors[self.affinity[name]]
+
+    def close(self):
+        """
+            Shutdown the pool
+
+            This doesn't wait for the operations of the targets that have
+            timed out.
+        """
+        for executor in self.executors:
+            executor.shutdown(wait=False)
+        self.executors = []
+
+    def run(self, function, *args, timeout=None):
+        """
+            Run an operation on all the targets
+
+            :param function: The operation, called with the Device object of
+                             target and args. With the process pool, it must
+                             be picklable (e.g. a module level function).
+            :param args: The arguments of operation
+            :param timeout: The time allowed to each target, in seconds,
+                            counted from the start of run(), or None
+            :return: A FleetResults object
+        """
+        results = FleetResults()
+        futures = {}
+        for name in self.targets:
+            if name in self.busy:
+                if not self.busy[name].done():
+                    results.errors[name] = TimeoutError(
+                        "{} is still running a previous operation"
+                        .format(name))
+                    continue
+                del self.busy[name]
+            executor = self.get_executor(name)
+            if self.pool == 'thread':
+                futures[name] = executor.submit(function, self.devices[name],
+                                                *args)
+            else:
+                futures[name] = executor.submit(_fleet_run, name,
+                                                self.targets[name],
+                                                self.device_class, function,
+                                                args)
+
+        deadline = None if timeout is None else monotonic() + timeout
+        for name, future in futures.items():
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - monotonic(), 0)
+            try:
+                results[name] = future.result(remaining)
+            except FutureTimeoutError:
+                if not future.cancel():
+                    self.busy[name] = future
+                results.errors[name] = TimeoutError(
+                    "{} timed out".format(name))
+            except Exception as error:
+                results.errors[name] = error
+        return results
+
+    def read(self, peripheral, register, timeout=None):
+        """
+            Read a register on all the targets
+
+            :param peripheral: The name of peripheral
+            :param register: The name of register
+            :param timeout: The time allowed to each target, in seconds
+            :return: A FleetResults object
+        """
+        return self.run(_read_register, peripheral, register, timeout=timeout)
+
+    def snapshot(self, peripherals=None, timeout=None):
+        """
+            Take a snapshot of all the targets
+
+            See Device.snapshot().
+
+            :param peripherals: A list of peripheral names. If None, take a
+                                snapshot of all the peripherals.
+            :param timeout: The time allowed to each target, in seconds
+            :return: A FleetResults object, with Snapshot objects as values
+        """
+        results = self.run(_snapshot, peripherals, timeout=timeout)
+        for snapshot in results.values():
+            snapshot.svd = self.svd
+        return results
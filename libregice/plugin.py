@@ -25,6 +25,8 @@
 
 from libregice import RegiceOpenOCD, RegiceJLink, RegiceClientTest
 from libregice.device import Device
+from libregice.regiceremote import RegiceRemoteClient
+from libregice.svdcache import load_svd_cached
 from regicecommon.helpers import load_svd
 from regicecommon.pkg import get_compatible_module
 
@@ -37,11 +39,39 @@ def init_args(parser):
         "--svd", required=True,
         help="SVD file that contains registers definition"
     )
-
     parser.add_argument(
+        "--svd-cache", default=None, nargs='?', const='',
+        help="Cache the parsed SVD file, in the given directory or in the "
+             "default one. The cached tree only provides the registers "
+             "layout (no description nor enumerated values)."
+    )
+    init_client_args(parser)
+
+def init_client_args(parser):
+    """
+        Add arguments required to select and init the client.
+    """
+    group = parser.add_argument_group('openocd')
+    group.add_argument(
         "--openocd", action='store_true',
         help="Use openocd to connect to target"
     )
+    group.add_argument(
+        "--openocd-transport", default='telnet', choices=['telnet', 'tcl'],
+        help="Protocol used to talk to openocd"
+    )
+    group.add_argument(
+        "--openocd-host", default='localhost',
+        help="Host running openocd"
+    )
+    group.add_argument(
+        "--openocd-port", default=None, type=int,
+        help="Port of openocd server (default depends on transport)"
+    )
+    group.add_argument(
+        "--openocd-no-halt", action='store_true',
+        help="Access memory without halting the cpu (e.g. using the AHB-AP)"
+    )
 
     group = parser.add_argument_group('jlink')
     group.add_argument(
@@ -62,25 +92,29 @@ def init_args(parser):
         help="Use a mock as target"
     )
 
+    parser.add_argument(
+        "--remote", default=None,
+        help="Use a regice server, as a Unix socket path or host:port"
+    )
+
 def process_args(unused, args):
     """
         Process arguments to allocate a Device object
 
         The allocate a RegiceClient, load the SVD file in order to allocate
-        a Device object.
+        a Device object. If --svd-cache is given, the SVD file is loaded
+        from cache if it has already been parsed.
 
         :param unused: Not used, usually a None object
         :param args: Parsed arguments from ArgumentParser
         :return: A dictionary that contains svd, client and device objects
     """
-    if args.openocd:
-        client = RegiceOpenOCD()
-    if args.jlink:
-        client = RegiceJLink(args)
-    if args.test:
-        client = RegiceClientTest()
+    client = process_client_args(args)
 
-    svd = load_svd(args.svd)
+    if args.svd_cache is None:
+        svd = load_svd(args.svd)
+    else:
+        svd = load_svd_cached(args.svd, args.svd_cache or None)
     module = get_compatible_module(svd.name)
     if module:
         device = module.device_init(svd, client)
@@ -88,3 +122,34 @@ def process_args(unused, args):
         device = Device(svd, client)
 
     return {'device': device, 'svd': svd, 'client': client}
+
+def process_client_args(args):
+    """
+        Process arguments to allocate a RegiceClient object
+
+        :param args: Parsed arguments from ArgumentParser
+        :return: A RegiceClient object
+    """
+    client = None
+    if args.openocd:
+        client = RegiceOpenOCD(args.openocd_transport, args.openocd_host,
+                               args.openocd_port, not args.openocd_no_halt)
+    if args.jlink:
+        client = RegiceJLink(args)
+    if args.test:
+        client = RegiceClientTest()
+    if args.remote:
+        client = RegiceRemoteClient(parse_remote_address(args.remote))
+    return client
+
+def parse_remote_address(address):
+    """
+        Parse the address of a regice server
+
+        :param address: The path of a Unix socket, or host:port
+        :return: The path of Unix socket, or a (host, port) tuple
+    """
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return (host, int(port))
+    return address
@@ -23,6 +23,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import queue
+import threading
+import traceback
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from libregice.decoder import AddressDecoder
+
 class InvalidField(Exception):
     """
         An exception raised if the requested field doesn't exist
@@ -54,6 +66,65 @@ class InvalidPeripheral(Exception):
     def __init__(self, peripheral):
         super().__init__("Invalid peripheral " + peripheral)
 
+def decode_fields(fields, values):
+    """
+        Decode the fields of many register values at once
+
+        If NumPy is available, the values are converted to an array (without
+        copy if possible) and each field is extracted with one vectorized
+        shift and mask. Otherwise, this falls back to a Python loop.
+
+        :param fields: A list of (field, bitOffset, mask) tuples
+        :param values: A NumPy array, an array.array or any sequence of
+                       register values
+        :return: A dictionnary with the field name as key, and an array of
+                 field values (a NumPy array, or an array.array if NumPy is
+                 not available)
+    """
+    columns = {}
+    if numpy is not None:
+        values = numpy.asarray(values, dtype=numpy.uint64)
+        for field, offset, mask in fields:
+            columns[field] = (values >> numpy.uint64(offset)) & \
+                             numpy.uint64(mask)
+        return columns
+
+    for field, offset, mask in fields:
+        columns[field] = array('Q', [(value >> offset) & mask
+                                     for value in values])
+    return columns
+
+def coalesce_addresses(addresses, width, max_gap=0):
+    """
+        Merge a list of addresses into spans that could be read at once
+
+        This sorts the addresses and merges the contiguous ones into spans.
+        Two addresses separated by no more than max_gap unused words are
+        merged into the same span, the unused words being read too.
+
+        :param addresses: The list of addresses to merge
+        :param width: The size, in bits, of each word
+        :param max_gap: The maximum number of unused words allowed between two
+                        addresses of a span
+        :return: A list of (address, count) tuples, one for each span
+    """
+    stride = width // 8
+    spans = []
+    start = None
+    end = None
+    for address in sorted(set(addresses)):
+        if start is not None and (address - start) % stride == 0 and \
+           address - end <= max_gap * stride:
+            end = address + stride
+            continue
+        if start is not None:
+            spans.append((start, (end - start) // stride))
+        start = address
+        end = address + stride
+    if start is not None:
+        spans.append((start, (end - start) // stride))
+    return spans
+
 class Watchpoint:
     """
         A class to abstract watchpoint
@@ -86,7 +157,7 @@ class Watchpoint:
         """
         raise NotImplementedError
 
-    def run(self, pc_address):
+    def run(self, pc_address, context=None):
         """
             Execute a callback on wtchpoint hit
 
@@ -94,8 +165,91 @@ class Watchpoint:
             The given address is the PC address that caused the hit.
             Note that a couple of instructions may have be ran before the cpu
             stop, so PC address may be incorrect.
+            If a context has been captured on hit (see
+            RegiceClient.watchpoint_dispatch()), it is passed to the callback
+            as third argument.
+
+            :param pc_address: The PC address that caused the hit
+            :param context: A dictionnary of values read on hit, or None
+        """
+        if context is None:
+            self.callback(pc_address, self.data)
+        else:
+            self.callback(pc_address, self.data, context)
+
+class WatchpointDispatcher:
+    """
+        A class to execute the watchpoint callbacks in worker threads
+
+        The hits are queued in a bounded queue, and executed by a pool of
+        worker threads, so a slow callback doesn't stall the thread that
+        monitors the device. If the queue is full, the monitor thread waits
+        until a worker takes a hit.
+
+        :param workers: The number of worker threads
+        :param queue_size: The maximum number of pending hits
+        :param resume: If True, the cpu is resumed as soon as the hit has
+                       been queued. Otherwise, it is resumed once the
+                       callbacks have been executed.
+        :param context: A dictionnary with the width as key, and the list of
+                        address to read on hit for that width, or None
+    """
+    def __init__(self, workers=1, queue_size=64, resume=False, context=None):
+        self.queue = queue.Queue(queue_size)
+        self.resume = resume
+        self.context = context
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, watchpoints, pc_address, context, done=None):
+        """
+            Queue a hit
+
+            :param watchpoints: The list of watchpoints that have been hit
+            :param pc_address: The PC address that caused the hit
+            :param context: A dictionnary of values read on hit, or None
+            :param done: A function to call once the callbacks have been
+                         executed, or None
+        """
+        self.queue.put((watchpoints, pc_address, context, done))
+
+    def worker(self):
+        """
+            Execute the callbacks of queued hits, until join() is called
+        """
+        while True:
+            hit = self.queue.get()
+            if hit is None:
+                self.queue.task_done()
+                return
+            watchpoints, pc_address, context, done = hit
+            try:
+                for watchpoint in watchpoints:
+                    watchpoint.run(pc_address, context)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                if done:
+                    done()
+                self.queue.task_done()
+
+    def wait(self):
+        """
+            Wait until all the queued hits have been executed
+        """
+        self.queue.join()
+
+    def join(self):
+        """
+            Execute the queued hits, and stop the worker threads
         """
-        self.callback(pc_address, self.data)
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
 
 class RegiceClient:
     """
@@ -106,6 +260,8 @@ class RegiceClient:
     """
     def __init__(self):
         self.watchpoints = {}
+        self.read_gap = 0
+        self.dispatcher = None
 
     def read(self, width, address):
         """
@@ -117,16 +273,63 @@ class RegiceClient:
         """
         raise NotImplementedError
 
+    def read_block(self, address, count, width):
+        """
+            Read a block of contiguous registers
+
+            This default implementation reads the registers one by one.
+            Clients able to perform block transfers should override it.
+
+            :param address: The physical address of the first register to read
+            :param count: The number of registers to read
+            :param width: The size, in bits, of each register
+            :return: A list of values
+        """
+        stride = width // 8
+        return [self.read(width, address + i * stride) for i in range(count)]
+
     def read_list(self, addresses):
         """
             Read the value of addresses listed in addresses
 
+            The addresses are merged into spans (see coalesce_addresses()),
+            and each span is read using read_block().
+
             :param addresses: A dictionnary with the width as key, and the list
                               of address to read for that width
             :return: a dictionnary of value read, and with the address used as
                      key
         """
-        raise NotImplementedError
+        return self.read_coalesced(addresses, self.read_block)
+
+    def read_coalesced(self, addresses, read_block):
+        """
+            Read the value of addresses using block transfers
+
+            This merges the addresses into spans, reads each span using
+            read_block, and slices the result back into a dictionnary.
+            The unused words read to fill the gaps are dropped.
+            read_gap attribute sets the maximum number of unused words allowed
+            in a span.
+
+            :param addresses: A dictionnary with the width as key, and the list
+                              of address to read for that width
+            :param read_block: The method to use to read a span
+            :return: a dictionnary of value read, and with the address used as
+                     key
+        """
+        values = {}
+        for width in addresses:
+            stride = width // 8
+            requested = set(addresses[width])
+            for start, count in coalesce_addresses(requested, width,
+                                                   self.read_gap):
+                block = read_block(start, count, width)
+                for i in range(count):
+                    address = start + i * stride
+                    if address in requested:
+                        values[address] = block[i]
+        return values
 
     def write(self, width, address, value):
         """
@@ -138,6 +341,55 @@ class RegiceClient:
         """
         raise NotImplementedError
 
+    def write_block(self, address, values, width):
+        """
+            Write a block of contiguous registers
+
+            This default implementation writes the registers one by one.
+            Clients able to perform block transfers should override it.
+
+            :param address: The physical address of the first register to
+                            write
+            :param values: The list of values to write
+            :param width: The size, in bits, of each register
+        """
+        stride = width // 8
+        for i, value in enumerate(values):
+            self.write(width, address + i * stride, value)
+
+    def write_list(self, values):
+        """
+            Write a list of values to registers
+
+            The contiguous registers are merged into runs, ordered by address,
+            and each run is written using write_block().
+
+            :param values: A dictionnary with the width as key, and a
+                           dictionnary of values to write for that width, with
+                           the address used as key
+        """
+        self.write_coalesced(values, self.write_block)
+
+    def write_coalesced(self, values, write_block):
+        """
+            Write a list of values to registers using block transfers
+
+            This merges the contiguous registers into runs, and writes each
+            run using write_block.
+            Unlike read_coalesced(), the runs never contain gaps.
+
+            :param values: A dictionnary with the width as key, and a
+                           dictionnary of values to write for that width, with
+                           the address used as key
+            :param write_block: The method to use to write a run
+        """
+        for width in values:
+            stride = width // 8
+            for start, count in coalesce_addresses(values[width], width):
+                block = [values[width][start + i * stride]
+                         for i in range(count)]
+                write_block(start, block, width)
+
     def watchpoint(self, address, length, access, callback, data):
         """
             Add and enable a watchpoint
@@ -154,6 +406,70 @@ class RegiceClient:
         """
         raise NotImplementedError
 
+    def watchpoint_dispatch(self, workers=1, queue_size=64, resume=False,
+                            context=None):
+        """
+            Execute the watchpoint callbacks in worker threads
+
+            By default, the callbacks are executed by the thread that detects
+            the hit, while the cpu is halted. This configures a
+            WatchpointDispatcher to execute them in worker threads instead.
+            If context is set, the registers it lists are read while the cpu
+            is halted, and the values are passed to the callbacks as third
+            argument.
+
+            :param workers: The number of worker threads
+            :param queue_size: The maximum number of pending hits
+            :param resume: If True, resume the cpu as soon as the context has
+                           been captured, without waiting for the callbacks
+            :param context: A dictionnary with the width as key, and the list
+                            of address to read on hit for that width, or None
+            :return: The WatchpointDispatcher object
+        """
+        if self.dispatcher:
+            self.dispatcher.join()
+        self.dispatcher = WatchpointDispatcher(workers, queue_size, resume,
+                                               context)
+        return self.dispatcher
+
+    def capture_context(self):
+        """
+            Read the registers to pass to callbacks on watchpoint hit
+
+            This is called while the cpu is halted by the watchpoint.
+
+            :return: a dictionnary of value read, and with the address used as
+                     key, or None if no context has been configured
+        """
+        if self.dispatcher is None or not self.dispatcher.context:
+            return None
+        return self.read_list(self.dispatcher.context)
+
+    def watchpoint_hit(self, watchpoints, pc_address, resume=None):
+        """
+            Execute the callbacks of watchpoints that have been hit
+
+            This is called by the clients when a watchpoint hit is detected.
+            If a dispatcher has been configured, the callbacks are executed by
+            its workers. Otherwise, they are executed immediately.
+
+            :param watchpoints: The list of watchpoints that have been hit
+            :param pc_address: The PC address that caused the hit
+            :param resume: A function to resume the cpu, or None
+        """
+        if self.dispatcher is None:
+            for watchpoint in watchpoints:
+                watchpoint.run(pc_address)
+            if resume:
+                resume()
+            return
+
+        context = self.capture_context()
+        if self.dispatcher.resume and resume:
+            resume()
+            resume = None
+        self.dispatcher.submit(watchpoints, pc_address, context, resume)
+
     def enable_watchpoint(self, address):
         """
             Enable the watchpoint
@@ -206,6 +522,103 @@ class Regice:
         self.svd = svd
         self.peripheral = None
         self.client = client
+        self.index = None
+        self.fields_index = None
+        self.address_index = None
+        self.decoder = None
+
+    def build_index(self):
+        """
+            Build the name and address indexes
+
+            This walks the SVD once, and builds:
+            - index, that maps "PERIPH.REG" and "PERIPH.REG.FIELD" names to
+              (address, width, bitOffset, mask) tuples, the mask being
+              applied after the shift
+            - fields_index, that maps "PERIPH.REG" names to a tuple of
+              (field, bitOffset, mask) tuples
+            - address_index, that maps an address to the "PERIPH.REG" name
+              of register at this address
+            This is done on first lookup, and could be called again if the SVD
+            has been modified.
+        """
+        index = {}
+        fields_index = {}
+        address_index = {}
+        for peripheral_name in self.svd.peripherals:
+            peripheral = self.svd.peripherals[peripheral_name]
+            for register_name in peripheral.registers:
+                register = peripheral.registers[register_name]
+                name = peripheral_name + '.' + register_name
+                address = register.address()
+                width = register.size
+                index[name] = (address, width, 0, (1 << width) - 1)
+                if not address in address_index:
+                    address_index[address] = name
+
+                fields = []
+                for field_name in register.fields:
+                    field = register.fields[field_name]
+                    mask = (1 << field.bitWidth) - 1
+                    index[name + '.' + field_name] = (address, width,
+                                                      field.bitOffset, mask)
+                    fields.append((field_name, field.bitOffset, mask))
+                fields_index[name] = tuple(fields)
+
+        self.index = index
+        self.fields_index = fields_index
+        self.address_index = address_index
+
+    def lookup(self, peripheral, register, field=None):
+        """
+            Lookup a register or a field in index
+
+            :param peripheral: The name of peripheral
+            :param register: The name of register
+            :param field: The name of field, or None to lookup the register
+            :return: A (address, width, bitOffset, mask) tuple, or raise an
+                     InvalidPeripheral, InvalidRegister or InvalidField
+                     exception if the register or field doesn't exist
+        """
+        if self.index is None:
+            self.build_index()
+        name = peripheral + '.' + register
+        if field is not None:
+            name += '.' + field
+        try:
+            return self.index[name]
+        except KeyError:
+            if field is None:
+                self.svd_get_register(None, peripheral, register)
+                raise InvalidRegister(peripheral, register)
+            self.svd_get_field(None, peripheral, register, field)
+            raise InvalidField(register, field)
+
+    def decode(self, address, length=1):
+        """
+            Find the registers and fields covering an address range
+
+            See AddressDecoder.decode().
+
+            :param address: The first address of the range
+            :param length: The length of range, in bytes
+            :return: A list of (peripheral, register, fields) tuples
+        """
+        if self.decoder is None:
+            self.decoder = AddressDecoder(self.svd)
+        return self.decoder.decode(address, length)
+
+    def get_register_name(self, address):
+        """
+            Return the name of register at the given address
+
+            :param address: The physical address of register
+            :return: A "PERIPH.REG" string, or None if there is no register at
+                     this address
+        """
+        if self.address_index is None:
+            self.build_index()
+        return self.address_index.get(address)
 
     def svd_get_peripheral_list(self):
         """
@@ -369,8 +782,7 @@ class Regice:
             :param register: The name of register
             :return: The physical address
         """
-        register = self.svd_get_register(None, peripheral, register)
-        return register.address()
+        return self.lookup(peripheral, register)[0]
 
     def get_base_address(self, peripheral):
         """
@@ -389,8 +801,7 @@ class Regice:
             :param register: The name of register
             :return: The size of register, in bytes
         """
-        register = self.svd_get_register(None, peripheral, register)
-        return int(register.size / 4)
+        return int(self.lookup(peripheral, register)[1] / 4)
 
     def read(self, peripheral, register):
         """
@@ -400,8 +811,8 @@ class Regice:
             :param register: The name of register
             :return: The value of register
         """
-        register = self.svd_get_register(None, peripheral, register)
-        return self.client.read(register.size, register.address())
+        address, width, offset, mask = self.lookup(peripheral, register)
+        return self.client.read(width, address)
 
     def write(self, peripheral, register, value):
         """
@@ -411,8 +822,8 @@ class Regice:
             :param register: The name of register
             :param value: The value to write
         """
-        register = self.svd_get_register(None, peripheral, register)
-        return self.client.write(register.size, register.address(), value)
+        address, width, offset, mask = self.lookup(peripheral, register)
+        return self.client.write(width, address, value)
 
     def read_fields(self, peripheral, register):
         """
@@ -422,17 +833,33 @@ class Regice:
             :param register: The name of register
             :return: A dict of fields
         """
-        value = self.read(peripheral, register)
-        register = self.svd_get_register(None, peripheral, register)
-        fields = register.fields
+        address, width, offset, mask = self.lookup(peripheral, register)
+        value = self.client.read(width, address)
 
         fields_list = {}
-        for field in fields:
-            mask = (1 << fields[field].bitWidth) - 1
-            fields_list[field] = (value >> fields[field].bitOffset) & mask
+        for field, offset, mask in self.fields_index[peripheral + '.' +
+                                                     register]:
+            fields_list[field] = (value >> offset) & mask
 
         return fields_list
 
+    def decode_fields(self, peripheral, register, values):
+        """
+            Decode the fields of many values of register at once
+
+            This is useful to decode the samples of a register captured at
+            high rate. See decode_fields() for more details.
+
+            :param peripheral: The name of peripheral
+            :param register: The name of register
+            :param values: An array of register values
+            :return: A dictionnary with the field name as key, and an array
+                     of field values
+        """
+        self.lookup(peripheral, register)
+        return decode_fields(self.fields_index[peripheral + '.' + register],
+                             values)
+
     def write_fields(self, peripheral, register, fields):
         """
             Write one or more fields to register
@@ -440,11 +867,12 @@ class Regice:
             :param peripheral: The name of peripheral
             :param register: The name of register
             :param fields: A dict of fields
+            :return: The value returned by the client's write()
         """
         value = 0
-        register = self.svd_get_register(None, peripheral, register)
-        svd_fields = register.fields
+        address, width, offset, mask = self.lookup(peripheral, register)
 
         for field in fields:
-            value |= (int(fields[field]) << svd_fields[field].bitOffset)
-        return self.client.write(register.size, register.address(), value)
+            offset = self.lookup(peripheral, register, field)[2]
+            value |= (int(fields[field]) << offset)
+        return self.client.write(width, address, value)
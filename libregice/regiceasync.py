@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2018 BayLibre
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    This module provides asyncio clients.
+
+    AsyncRegiceClient is the asyncio counterpart of RegiceClient. It allows
+    to access to many targets from a single event loop, instead of using one
+    thread per target.
+    AsyncRegiceOpenOCD talks to the TCL RPC server of OpenOCD using asyncio
+    streams, and AsyncRegiceClientAdapter runs the methods of a synchronous
+    client (e.g. RegiceJLink) in an executor.
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from libregice.regice import Watchpoint, coalesce_addresses
+from libregice.regiceopenocd import DFSR, DFSR_DWTTRAP, DWT_COMP_BASE
+from libregice.regiceopenocd import DWT_CTRL, DWT_CTRL_NUMCOMP_SHIFT
+from libregice.regiceopenocd import DWT_FUNCTION_MATCHED, TCL_TERMINATOR
+from libregice.regiceopenocd import memory_read_command, memory_write_command
+from libregice.regiceopenocd import memory_write_commands
+from libregice.regiceopenocd import parse_memory_dump, read_spans
+
+class WatchpointHits:
+    """
+        An async iterator of watchpoint hits
+
+        Each item is the PC address that caused the hit. The iteration stops
+        when the client is closed. If the hits could not be checked, the
+        error is raised by the iteration.
+    """
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        pc_address = await self.queue.get()
+        if pc_address is None:
+            raise StopAsyncIteration
+        if isinstance(pc_address, Exception):
+            raise pc_address
+        return pc_address
+
+    def put(self, pc_address):
+        """
+            Report a hit
+
+            :param pc_address: The PC address that caused the hit, None to
+                               stop the iteration, or an exception to raise
+        """
+        self.queue.put_nowait(pc_address)
+
+class AsyncRegiceClient:
+    """
+        A class to abstract asynchronous access to memory and registers
+
+        This is the asyncio counterpart of RegiceClient. This is a base class
+        that must be derived.
+    """
+    async def read(self, width, address):
+        """
+            Read the value of register
+
+            :param width: The size, in bits, of the register
+            :param address: The physical address of register to read
+            :return: The value of register
+        """
+        raise NotImplementedError
+
+    async def read_list(self, addresses):
+        """
+            Read the value of addresses listed in addresses
+
+            This default implementation reads the registers one by one.
+
+            :param addresses: A dictionnary with the width as key, and the list
+                              of address to read for that width
+            :return: a dictionnary of value read, and with the address used as
+                     key
+        """
+        values = {}
+        for width in addresses:
+            for address in addresses[width]:
+                values[address] = await self.read(width, address)
+        return values
+
+    async def write(self, width, address, value):
+        """
+            Write a value to the register
+
+            :param width: The size, in bits, of the register
+            :param address: The physical address of register to write
+            :param value: The value to write to the register
+        """
+        raise NotImplementedError
+
+    async def write_list(self, values):
+        """
+            Write a list of values to registers
+
+            This default implementation writes the registers one by one.
+
+            :param values: A dictionnary with the width as key, and a
+                           dictionnary of values to write for that width, with
+                           the address used as key
+        """
+        for width in values:
+            for address in values[width]:
+                await self.write(width, address, values[width][address])
+
+    async def watchpoint(self, address, length, access):
+        """
+            Add and enable a watchpoint
+
+            :param address: The start address of the watchpoint
+            :param length: The length of watchpoint, in bytes
+            :param access: The type of access (R/W) that trigger the watchpoint
+            :return: A WatchpointHits async iterator
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        """
+            Close the client
+        """
+
+class AsyncRegiceClientAdapter(AsyncRegiceClient):
+    """
+        An asynchronous client, on top of a synchronous one
+
+        Each access is executed by an executor. By default, a single worker
+        thread is used, so the accesses to the client are serialized.
+
+        :param client: The RegiceClient object, e.g. a RegiceJLink object
+        :param executor: The executor, or None to use a single worker thread
+    """
+    def __init__(self, client, executor=None):
+        self.client = client
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.hits = []
+
+    async def run(self, method, *args):
+        """
+            Execute a method of client in the executor
+
+            :param method: The method to execute
+            :param args: The arguments of the method
+            :return: The value returned by the method
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, method, *args)
+
+    async def read(self, width, address):
+        return await self.run(self.client.read, width, address)
+
+    async def read_list(self, addresses):
+        return await self.run(self.client.read_list, addresses)
+
+    async def write(self, width, address, value):
+        await self.run(self.client.write, width, address, value)
+
+    async def write_list(self, values):
+        await self.run(self.client.write_list, values)
+
+    async def watchpoint(self, address, length, access):
+        loop = asyncio.get_running_loop()
+        hits = WatchpointHits()
+
+        def callback(pc_address, data, context=None):
+            loop.call_soon_threadsafe(hits.put, pc_address)
+
+        await self.run(self.client.watchpoint, address, length, access,
+                       callback, None)
+        self.hits.append(hits)
+        return hits
+
+    async def close(self):
+        for hits in self.hits:
+            hits.put(None)
+        close = getattr(self.client, 'close', None)
+        if close:
+            await self.run(close)
+        self.executor.shutdown()
+
+class AsyncRegiceOpenOCD(AsyncRegiceClient):
+    """
+        An asynchronous client, using the OpenOCD TCL RPC protocol
+
+        The commands are written back to back, and the replies are matched to
+        them in order by a reader task, so concurrent accesses don't wait for
+        each other. Each access sends the halt, the memory commands and the
+        resume at once, so it only costs one round trip.
+        Use connect() to create the client.
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = deque()
+        self.watchpoints = {}
+        self.max_watchpoints = None
+        self.dwt = False
+        self.read_gap = 0
+        self.tasks = set()
+        self.task = asyncio.get_running_loop().create_task(self.receive())
+
+    @classmethod
+    async def connect(cls, host='localhost', port=6666):
+        """
+            Connect to OpenOCD
+
+            :param host: The host running OpenOCD
+            :param port: The port of the TCL RPC server
+            :return: An AsyncRegiceOpenOCD object
+        """
+        reader, writer = await asyncio.open_connection(host, port)
+        client = cls(reader, writer)
+        await client.execute([('tcl_notifications', 'on')])
+        return client
+
+    async def receive(self):
+        """
+            Read the replies and the notifications
+
+            This runs until the connection is closed.
+        """
+        try:
+            while True:
+                message = await self.reader.readuntil(TCL_TERMINATOR)
+                message = message[:-1].decode()
+                if message.startswith('type target_'):
+                    if message.strip().endswith('halted') and \
+                       self.watchpoints:
+                        # Keep a reference, the loop only keeps a weak one
+                        task = asyncio.get_running_loop().create_task(
+                            self.watchpoint_hit())
+                        self.tasks.add(task)
+                        task.add_done_callback(self.tasks.discard)
+                elif self.pending:
+                    future = self.pending.popleft()
+                    if not future.done():
+                        future.set_result(message.splitlines())
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            while self.pending:
+                future = self.pending.popleft()
+                if not future.done():
+                    future.set_exception(
+                        ConnectionError("OpenOCD closed the connection"))
+
+    async def execute(self, commands):
+        """
+            Execute a list of commands
+
+            :param commands: A list of tuples with the command and its
+                             arguments
+            :return: A list with the output of each command, as a list of
+                     lines
+        """
+        loop = asyncio.get_running_loop()
+        data = bytearray()
+        futures = []
+        for command in commands:
+            data += ' '.join([str(arg) for arg in command]).encode()
+            data += TCL_TERMINATOR
+            future = loop.create_future()
+            self.pending.append(future)
+            futures.append(future)
+        self.writer.write(data)
+        await self.writer.drain()
+        return await asyncio.gather(*futures)
+
+    async def read(self, width, address):
+        values = await self.read_list({width: [address]})
+        return values[address]
+
+    async def read_list(self, addresses, halt=True):
+        """
+            Read the value of addresses listed in addresses
+
+            This halts the cpu, reads the addresses using block transfers and
+            resumes the cpu, using a single round trip.
+
+            :param addresses: A dictionnary with the width as key, and the list
+                              of address to read for that width
+            :param halt: If False, read the addresses without halting the cpu
+            :return: a dictionnary of value read, and with the address used as
+                     key
+        """
+        spans = []
+        for width in addresses:
+            for start, count in coalesce_addresses(addresses[width], width,
+                                                   self.read_gap):
+                spans.append((start, count, width))
+        commands = [memory_read_command(*span) for span in spans]
+        if halt:
+            commands = [('halt', 1)] + commands + [('resume',)]
+        outputs = await self.execute(commands)
+        if halt:
+            outputs = outputs[1:-1]
+        return read_spans(addresses, spans, outputs)
+
+    async def write(self, width, address, value):
+        await self.write_list({width: {address: value}})
+
+    async def write_list(self, values, halt=True):
+        """
+            Write a list of values to registers
+
+            This halts the cpu, writes the registers using block transfers and
+            resumes the cpu, using a single round trip.
+
+            :param values: A dictionnary with the width as key, and a
+                           dictionnary of values to write for that width, with
+                           the address used as key
+            :param halt: If False, write the registers without halting the cpu
+        """
+        commands = []
+        for width in values:
+            stride = width // 8
+            for start, count in coalesce_addresses(values[width], width):
+                block = [values[width][start + i * stride]
+                         for i in range(count)]
+                commands += memory_write_commands(start, block, width)
+        if halt:
+            commands = [('halt', 1)] + commands + [('resume',)]
+        await self.execute(commands)
+
+    async def probe_dwt(self):
+        """
+            Find out the number of watchpoints supported by the cpu
+
+            See RegiceOpenOCD.probe_dwt().
+        """
+        try:
+            ctrl = await self.read(32, DWT_CTRL)
+        except (ValueError, IndexError):
+            ctrl = 0
+        self.dwt = ctrl >> DWT_CTRL_NUMCOMP_SHIFT != 0
+        self.max_watchpoints = (ctrl >> DWT_CTRL_NUMCOMP_SHIFT) or 1
+
+    async def watchpoint(self, address, length, access):
+        if self.max_watchpoints is None:
+            await self.probe_dwt()
+        if len(self.watchpoints) >= self.max_watchpoints:
+            raise IndexError("No more than {} watchpoints are supported"
+                             .format(self.max_watchpoints))
+        if access == Watchpoint.RW:
+            mode = 'a'
+        elif access == Watchpoint.READ:
+            mode = 'r'
+        else:
+            mode = 'w'
+        await self.execute([('wp', hex(address), length, mode)])
+        hits = WatchpointHits()
+        self.watchpoints[address] = hits
+        return hits
+
+    async def watchpoint_hit(self):
+        """
+            Report the watchpoints that have stopped the cpu
+
+            See RegiceOpenOCD.watchpoint_hits(). The cpu is resumed unless
+            it hasn't been stopped by the DWT. If the hits could not be
+            checked, the error is reported to all the watchpoints, and the
+            cpu is resumed.
+        """
+        resume = True
+        try:
+            dfsr = None
+            if self.dwt:
+                try:
+                    dfsr = await self.read_list({32: [DFSR]}, halt=False)
+                except (ValueError, IndexError):
+                    pass
+            if dfsr is None:
+                outputs = await self.execute([('reg', 'pc')])
+                hits = list(self.watchpoints.values())
+                pc_address = int(outputs[0][-1].split()[-1], 16)
+            elif dfsr[DFSR] & DFSR_DWTTRAP == 0:
+                resume = False
+                return
+            else:
+                hits, pc_address = await self.dwt_hits()
+            for watchpoint in hits:
+                watchpoint.put(pc_address)
+        except Exception as error:
+            for watchpoint in self.watchpoints.values():
+                watchpoint.put(error)
+        finally:
+            if resume:
+                try:
+                    await self.execute([('resume',)])
+                except (ConnectionError, OSError):
+                    pass
+
+    async def dwt_hits(self):
+        """
+            Find the watchpoints that have stopped the cpu, using the DWT
+
+            :return: A tuple with the list of WatchpointHits objects that
+                     have been hit, and the PC address
+        """
+        count = self.max_watchpoints or 1
+        outputs = await self.execute([
+            memory_write_command(DFSR, [DFSR_DWTTRAP], 32),
+            memory_read_command(DWT_COMP_BASE, count * 4, 32),
+            ('reg', 'pc'),
+        ])
+        comparators = parse_memory_dump(outputs[1], 4)
+        pc_address = int(outputs[2][-1].split()[-1], 16)
+
+        hits = []
+        for i in range(count):
+            comp = comparators.get(DWT_COMP_BASE + i * 16, 0)
+            function = comparators.get(DWT_COMP_BASE + i * 16 + 8, 0)
+            if function & DWT_FUNCTION_MATCHED and comp in self.watchpoints:
+                hits.append(self.watchpoints[comp])
+        if not hits and len(self.watchpoints) == 1:
+            hits = list(self.watchpoints.values())
+        return hits, pc_address
+
+    async def close(self):
+        for hits in self.watchpoints.values():
+            hits.put(None)
+        self.writer.close()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
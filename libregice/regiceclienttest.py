@@ -192,10 +192,11 @@ class RegisterSimulation:
                     self.peripheral_name, field_name))
                 value = field.read()
                 address = field.address()
-                for wp_address in self.client.watchpoints:
-                    watchpoint = self.client.watchpoints[wp_address]
-                    if watchpoint.test_read(address):
-                        watchpoint.run(section)
+                watchpoints = [watchpoint for watchpoint
+                               in self.client.watchpoints.values()
+                               if watchpoint.test_read(address)]
+                if watchpoints:
+                    self.client.watchpoint_hit(watchpoints, section)
                 continue
             field = eval('self.device.{}.{}'.format(
                 self.peripheral_name, option))
@@ -203,10 +204,11 @@ class RegisterSimulation:
             field.write(int(value))
 
             address = field.address()
-            for wp_address in self.client.watchpoints:
-                watchpoint = self.client.watchpoints[wp_address]
-                if watchpoint.test_write(address):
-                    watchpoint.run(section)
+            watchpoints = [watchpoint for watchpoint
+                           in self.client.watchpoints.values()
+                           if watchpoint.test_write(address)]
+            if watchpoints:
+                self.client.watchpoint_hit(watchpoints, section)
 
     def sleep(self, timeout=0):
         """
@@ -276,6 +278,8 @@ class RegiceClientTest(RegiceClient):
             0x0000123c: 0x80000000,
         }
         self.memory = {}
+        self.block_reads = 0
+        self.block_writes = 0
         self.memory_restore()
 
     def memory_restore(self):
@@ -301,20 +305,29 @@ class RegiceClientTest(RegiceClient):
             self.memory[address] = 0
         return self.memory[address]
 
-    def read_list(self, addresses):
+    def read_block(self, address, count, width):
         """
-            Read the value of addresses listed in dict
+            Read a block of contiguous registers
 
-            :param dict: A dictionnary with the width as key, and the list of
-                         address to read for that width
-            :return: a dictionnary of value read, and with the address used as
-                     key
+            :param address: The physical address of the first register to read
+            :param count: The number of registers to read
+            :param width: The size, in bits, of each register
+            :return: A list of values
         """
-        values = {}
-        for width in addresses:
-            for address in addresses[width]:
-                values[address] = self.read(width, address)
-        return values
+        self.block_reads += 1
+        return super(RegiceClientTest, self).read_block(address, count, width)
+
+    def write_block(self, address, values, width):
+        """
+            Write a block of contiguous registers
+
+            :param address: The physical address of the first register to
+                            write
+            :param values: The list of values to write
+            :param width: The size, in bits, of each register
+        """
+        self.block_writes += 1
+        super(RegiceClientTest, self).write_block(address, values, width)
 
     def write(self, width, address, value):
         """
@@ -33,6 +33,7 @@ class RegiceJLink(RegiceClient):
         This class provides a way to read and write memory using JTAG.
     """
     def __init__(self, args):
+        super(RegiceJLink, self).__init__()
         self.jlink = JLink()
         self.jlink.open()
         if args.jlink_script:
@@ -58,3 +59,25 @@ class RegiceJLink(RegiceClient):
             :param value: The value to write to the register
         """
         self.jlink.memory_write(address, [value], None, width)
+
+    def read_block(self, address, count, width):
+        """
+            Read a block of contiguous registers
+
+            :param address: The physical address of the first register to read
+            :param count: The number of registers to read
+            :param width: The size, in bits, of each register
+            :return: A list of values
+        """
+        return self.jlink.memory_read(address, count, None, width)
+
+    def write_block(self, address, values, width):
+        """
+            Write a block of contiguous registers
+
+            :param address: The physical address of the first register to
+                            write
+            :param values: The list of values to write
+            :param width: The size, in bits, of each register
+        """
+        self.jlink.memory_write(address, values, None, width)
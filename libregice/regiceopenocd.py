@@ -23,25 +23,177 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import os
+import queue
+import selectors
+import socket
 import threading
-import time
+from array import array
+from collections import deque
+from concurrent.futures import Future
 
 from OpenOCD import OpenOCD
 from libregice import RegiceClient, Watchpoint
+from libregice.regice import coalesce_addresses
+
+MEMORY_DUMP_COMMANDS = {8: 'mdb', 16: 'mdh', 32: 'mdw', 64: 'mdd'}
+MEMORY_WRITE_COMMANDS = {8: 'mwb', 16: 'mwh', 32: 'mww', 64: 'mwd'}
+
+TCL_TERMINATOR = b'\x1a'
+
+# The maximum number of words written by a single write_memory command
+WRITE_MEMORY_CHUNK = 64
+
+# Cortex-M debug registers, used to find out which watchpoint has been hit
+DFSR = 0xE000ED30
+DFSR_DWTTRAP = 1 << 2
+DWT_CTRL = 0xE0001000
+DWT_CTRL_NUMCOMP_SHIFT = 28
+DWT_COMP_BASE = 0xE0001020
+DWT_FUNCTION_MATCHED = 1 << 24
+
+def memory_read_command(address, count, width):
+    """
+        Build the command to read a block of memory
+
+        :param address: The physical address of the first word to read
+        :param count: The number of words to read
+        :param width: The size, in bits, of each word
+        :return: A tuple with the command and its arguments
+    """
+    return (MEMORY_DUMP_COMMANDS[width], hex(address), count)
+
+def memory_write_command(address, values, width):
+    """
+        Build the command to write a block of memory
+
+        A block of several words is written using the write_memory command,
+        which requires OpenOCD 0.12 or later.
+
+        :param address: The physical address of the first word to write
+        :param values: The list of values to write
+        :param width: The size, in bits, of each word
+        :return: A tuple with the command and its arguments
+    """
+    if len(values) == 1:
+        return (MEMORY_WRITE_COMMANDS[width], hex(address), hex(values[0]))
+    data = '{' + ' '.join([hex(value) for value in values]) + '}'
+    return ('write_memory', hex(address), width, data)
+
+def memory_write_commands(address, values, width):
+    """
+        Build the commands to write a block of memory
+
+        The block is split in chunks of WRITE_MEMORY_CHUNK words, so a large
+        block doesn't produce a very long command line.
+
+        :param address: The physical address of the first word to write
+        :param values: The list of values to write
+        :param width: The size, in bits, of each word
+        :return: A list of tuples with the command and its arguments
+    """
+    stride = width // 8
+    return [memory_write_command(address + i * stride,
+                                 values[i:i + WRITE_MEMORY_CHUNK], width)
+            for i in range(0, len(values), WRITE_MEMORY_CHUNK)]
+
+def parse_memory_dump(lines, stride):
+    """
+        Parse the output of a md{b,h,w,d} command
+
+        Each line of the dump starts with an address, followed by the value of
+        words read from this address, e.g. "0x00001234: 00100003 00010000".
+        Lines that don't look like a dump (e.g. the command echo) are ignored.
+
+        :param lines: The lines returned by OpenOCD
+        :param stride: The size, in bytes, of each word
+        :return: A dictionnary of value read, with the address used as key
+    """
+    values = {}
+    for line in lines:
+        address, sep, words = line.partition(':')
+        if not sep or not address.startswith('0x'):
+            continue
+        try:
+            address = int(address, 16)
+        except ValueError:
+            continue
+        for word in words.split():
+            values[address] = int(word, 16)
+            address += stride
+    return values
+
+def parse_memory_dump_array(lines, address, count, width):
+    """
+        Parse the output of a md{b,h,w,d} command into an array
+
+        Unlike parse_memory_dump(), this stores the words directly in an
+        array, indexed from the first address, without building a
+        dictionnary.
+
+        :param lines: The lines returned by OpenOCD
+        :param address: The physical address of the first word
+        :param count: The number of words
+        :param width: The size, in bits, of each word
+        :return: An array of values
+    """
+    stride = width // 8
+    values = array('Q', [0]) * count
+    parsed = 0
+    for line in lines:
+        start, sep, words = line.partition(':')
+        if not sep or not start.startswith('0x'):
+            continue
+        try:
+            index = (int(start, 16) - address) // stride
+        except ValueError:
+            continue
+        for word in words.split():
+            if 0 <= index < count:
+                values[index] = int(word, 16)
+                parsed += 1
+            index += 1
+    if parsed < count:
+        raise ValueError("Incomplete memory dump at {}".format(hex(address)))
+    return values
+
+def read_spans(addresses, spans, outputs):
+    """
+        Gather the values of addresses from the dumps of spans
+
+        :param addresses: A dictionnary with the width as key, and the list
+                          of address requested for that width
+        :param spans: A list of (start, count, width) tuples
+        :param outputs: The output of the md{b,h,w,d} command of each span
+        :return: a dictionnary of value read, and with the address used as
+                 key
+    """
+    requested = {width: set(addresses[width]) for width in addresses}
+    values = {}
+    for (start, count, width), lines in zip(spans, outputs):
+        stride = width // 8
+        dump = parse_memory_dump_array(lines, start, count, width)
+        for i in range(count):
+            address = start + i * stride
+            if address in requested[width]:
+                values[address] = dump[i]
+    return values
 
 class WatchpointOpenOCD(Watchpoint):
     """
         OpenOCD watchpoint
 
         This provides few methods to manage OpenOCD watchpoint.
-        :param ocd: OpenOCD object
+        The cpu is halted using the halt sessions of client, so enabling or
+        disabling a watchpoint doesn't resume a cpu halted by a session.
+        :param client: RegiceOpenOCD object
         :param address: The start address of the watchpoint
         :param length: The length of watchpoint, in bytes
         :param access: The type of access (R/W) that trigger the watchpoint
         :param callback: The callback to execute when watchpoint stops cpu
         :param data: The data to pass to callback
     """
-    def __init__(self, ocd, address, length, access, callback, data):
+    def __init__(self, client, address, length, access, callback, data):
         super(WatchpointOpenOCD, self).__init__(address, length, access,
                                                 callback, data)
         write = None
@@ -53,78 +205,558 @@ class WatchpointOpenOCD(Watchpoint):
             read = True
         elif access == Watchpoint.WRITE:
             write = True
-        self.ocd = ocd
-        self.watchpoint = self.ocd.WP(address, length, read, write, read_write)
+        self.client = client
+        self.watchpoint = client.ocd.WP(address, length, read, write,
+                                        read_write)
 
     def enable(self):
         """
             Enable the watchpoint
         """
-        self.ocd.Halt(1)
-        self.watchpoint.Enable()
-        self.ocd.Resume()
+        with self.client.halted():
+            self.watchpoint.Enable()
 
     def disable(self):
         """
             Disable the watchpoint
         """
-        self.ocd.Halt(1)
-        self.watchpoint.Disable()
-        self.ocd.Resume()
+        with self.client.halted():
+            self.watchpoint.Disable()
 
 class OpenOCDThreadSafe(OpenOCD):
     """
         A class derived from OpenOCD that is thread safe
+
+        A single thread owns the telnet connection. The other threads queue
+        their commands, and wait for a future. The I/O thread writes the
+        queued commands back to back, and matches the replies to them in
+        order, using the prompt that ends each reply.
+        The messages received while no command is in progress (e.g. the cpu
+        halt messages) are queued, and returned by Readout().
+
+        :param Host: The host running OpenOCD
+        :param Port: The port of the telnet server
+        :param Timeout: The time to wait for the reply of a command, in
+                        seconds, or None to wait forever
     """
-    def __init__(self, Host="localhost", Port=4444):
+    def __init__(self, Host="localhost", Port=4444, Timeout=10.0):
         self.lock = threading.Lock()
-        self.blocking = False
+        self.requests = queue.Queue()
+        self.inflight = deque()
+        self.output = []
+        self.buffer = bytearray()
+        self.scan = 0
+        self.notifications = []
+        self.closed = False
+        self.timeout = Timeout
+        self.notify_r, self.notify_w = os.pipe()
+        os.set_blocking(self.notify_r, False)
+        self.wake_r, self.wake_w = os.pipe()
         super(OpenOCDThreadSafe, self).__init__(Host, Port)
+        self.io_thread = threading.Thread(target=self.io_loop, daemon=True)
+        self.io_thread.start()
+
+    def io_loop(self):
+        """
+            Write the queued commands, and read the replies
+
+            This runs until close() is called, or the connection is closed.
+        """
+        selector = selectors.DefaultSelector()
+        selector.register(self.wake_r, selectors.EVENT_READ)
+        selector.register(self.tn.fileno(), selectors.EVENT_READ)
+        try:
+            while not self.closed:
+                for key, _ in selector.select():
+                    if key.fileobj == self.wake_r:
+                        os.read(self.wake_r, 4096)
+
+                data = ''
+                while True:
+                    try:
+                        command, future = self.requests.get_nowait()
+                    except queue.Empty:
+                        break
+                    self.inflight.append((command, future))
+                    data += command + '\n'
+                if data:
+                    self.tn.write(data.encode())
+
+                self.receive(self.tn.read_very_eager())
+        except (OSError, EOFError):
+            pass
+        finally:
+            with self.lock:
+                self.closed = True
+            while True:
+                try:
+                    self.inflight.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            while self.inflight:
+                self.inflight.popleft()[1].set_exception(
+                    ConnectionError("OpenOCD closed the connection"))
+            os.write(self.notify_w, b'\0')
+            selector.close()
+
+    def receive(self, data):
+        """
+            Parse the data received from OpenOCD
+
+            Each reply starts with the echo of command, and ends with the
+            prompt. The data is appended to a bytearray, and only the new
+            data is scanned for line ends, so a large reply is parsed in
+            linear time. Only the complete lines are decoded.
+
+            :param data: The data received, as bytes
+        """
+        buffer = self.buffer
+        buffer += data
+        start = 0
+        while True:
+            if buffer.startswith(b'> ', start):
+                start += 2
+                self.scan = start
+                self.complete()
+                continue
+            index = buffer.find(b'\n', max(start, self.scan))
+            if index < 0:
+                break
+            line = buffer[start:index].strip(b'\r')
+            start = index + 1
+            self.scan = start
+            if line:
+                self.output.append(line.decode(errors='replace'))
+        del buffer[:start]
+        self.scan = len(buffer)
+
+    def complete(self):
+        """
+            Handle the end of a reply
+
+            The reply is returned to the first command in progress, unless it
+            doesn't start with the echo of that command, which means this is a
+            message sent by OpenOCD on its own.
+        """
+        output = self.output
+        self.output = []
+        if self.inflight and output and self.inflight[0][0] in output[0]:
+            self.inflight.popleft()[1].set_result(output)
+        elif output:
+            with self.lock:
+                self.notifications += output
+            os.write(self.notify_w, b'\0')
 
     def Readout(self):
         """
-            Communication functions
+            Return the messages of cpu halt
+
+            This doesn't wait for data: if no halt message has been received,
+            this returns None.
+
+            :return: A list of messages, or None
+        """
+        try:
+            os.read(self.notify_r, 4096)
+        except BlockingIOError:
+            pass
+
+        with self.lock:
+            notifications = self.notifications
+            self.notifications = []
+        halted = [line for line in notifications if 'halted' in line]
+        if not halted and self.closed:
+            raise ConnectionError("OpenOCD closed the connection")
+        return halted or None
+
+    def submit(self, Cmd, *args):
+        """
+            Queue a command
+
+            :param Cmd: The command to execute
+            :param args: The arguments of the command
+            :return: A future, set with the output of the command, as a list
+                     of lines
+        """
+        future = Future()
+        command = ' '.join([str(arg) for arg in (Cmd,) + args])
+        with self.lock:
+            if self.closed:
+                future.set_exception(
+                    ConnectionError("OpenOCD closed the connection"))
+                return future
+            self.requests.put((command, future))
+        os.write(self.wake_w, b'\0')
+        return future
+
+    def Exec(self, Cmd, *args):
+        """
+            Execute a command
+
+            The command is executed by the I/O thread, so this could be called
+            from any thread.
+            If no reply is received within the timeout, this raises
+            concurrent.futures.TimeoutError.
+
+            :param Cmd: The command to execute
+            :param args: The arguments of the command
+            :return: The output of the command, as a list of lines
+        """
+        return self.submit(Cmd, *args).result(self.timeout)
+
+    def filenos(self):
+        """
+            Return the file descriptors to wait on before to call Readout()
+
+            :return: A list of file descriptors
+        """
+        return [self.notify_r]
+
+    def Pipeline(self, commands):
+        """
+            Execute a list of commands
+
+            All the commands are queued at once, so the I/O thread writes them
+            back to back.
+
+            :param commands: A list of tuples with the command and its
+                             arguments
+            :return: A list with the output of each command
+        """
+        futures = [self.submit(*command) for command in commands]
+        return [future.result(self.timeout) for future in futures]
+
+    def close(self):
+        """
+            Stop the I/O thread, and close the connection
+        """
+        with self.lock:
+            self.closed = True
+        os.write(self.wake_w, b'\0')
+        self.io_thread.join()
+        self.tn.close()
+        for fd in (self.wake_r, self.wake_w, self.notify_r, self.notify_w):
+            os.close(fd)
+
+    def acquire(self):
+        """
+            Acquire a lock to protect Readout method
+
+            Only the I/O thread reads the connection, so Readout() doesn't
+            need any lock. This is kept for compatibility with OpenOCDTcl.
+        """
+
+    def release(self):
+        """
+            Release the lock
+        """
+
+class OpenOCDTclRegister:
+    """
+        A cpu register, accessed using the OpenOCD TCL RPC protocol
+
+        :param ocd: OpenOCDTcl object
+        :param name: The name of register (e.g. 'pc')
+    """
+    def __init__(self, ocd, name):
+        self.ocd = ocd
+        self.name = name
+
+    def Read(self):
+        """
+            Read the value of register
+
+            :return: The value of register
+        """
+        lines = self.ocd.Exec('reg', self.name)
+        return int(lines[-1].split()[-1], 16)
+
+    def Write(self, value):
+        """
+            Write a value to register
+
+            :param value: The value to write
+        """
+        self.ocd.Exec('reg', self.name, hex(value))
+
+class OpenOCDTclWatchpoint:
+    """
+        A watchpoint, managed using the OpenOCD TCL RPC protocol
+
+        :param ocd: OpenOCDTcl object
+        :param address: The start address of the watchpoint
+        :param length: The length of watchpoint, in bytes
+        :param read: True to trigger the watchpoint on read access
+        :param write: True to trigger the watchpoint on write access
+        :param read_write: True to trigger the watchpoint on any access
+    """
+    def __init__(self, ocd, address, length, read, write, read_write):
+        self.ocd = ocd
+        self.address = address
+        self.length = length
+        if read_write:
+            self.mode = 'a'
+        elif read:
+            self.mode = 'r'
+        else:
+            self.mode = 'w'
+
+    def Enable(self):
+        """
+            Enable the watchpoint
+        """
+        self.ocd.Exec('wp', hex(self.address), self.length, self.mode)
+
+    def Disable(self):
+        """
+            Disable the watchpoint
+        """
+        self.ocd.Exec('rwp', hex(self.address))
+
+class OpenOCDTcl:
+    """
+        A class to talk to OpenOCD using the TCL RPC protocol
+
+        This provides the same interface as OpenOCDThreadSafe, but uses the
+        TCL RPC server of OpenOCD instead of the telnet one.
+        Each message is terminated by a 0x1a byte, which makes the protocol
+        much easier to parse than the telnet console, and allows to send
+        several commands before to read their replies (see Pipeline()).
+
+        The target event notifications are enabled, and used to detect when
+        the cpu halts (see Readout()).
+
+        :param Host: The host running OpenOCD
+        :param Port: The port of the TCL RPC server
+    """
+    def __init__(self, Host="localhost", Port=6666):
+        self.lock = threading.Lock()
+        self.buffer = bytearray()
+        self.notifications = []
+        self.notify_r, self.notify_w = os.pipe()
+        os.set_blocking(self.notify_r, False)
+        self.sock = socket.create_connection((Host, Port))
+        self.Exec('tcl_notifications', 'on')
+
+    def filenos(self):
+        """
+            Return the file descriptors to wait on before to call Readout()
+
+            Notifications received while waiting for the reply of a command
+            are queued, and the notify pipe is written to report them.
+
+            :return: A list of file descriptors
+        """
+        return [self.sock.fileno(), self.notify_r]
+
+    def send(self, commands):
+        """
+            Send a list of commands, without waiting for the replies
+
+            :param commands: A list of tuples with the command and its
+                             arguments
+        """
+        data = bytearray()
+        for command in commands:
+            data += ' '.join([str(arg) for arg in command]).encode()
+            data += TCL_TERMINATOR
+        self.sock.sendall(data)
+
+    def parse_message(self):
+        """
+            Extract a message from the receive buffer
+
+            :return: The message, or None if the buffer doesn't contain a
+                     complete message
+        """
+        index = self.buffer.find(TCL_TERMINATOR)
+        if index < 0:
+            return None
+        message = self.buffer[:index].decode()
+        del self.buffer[:index + 1]
+        return message
+
+    def receive(self):
+        """
+            Wait for the reply of a command
 
-            This works exactly like the original method except that
-            if blocking attribute is False then the method will return None
-            instead of waiting for data.
+            The notifications received while waiting are queued, and will be
+            returned by Readout().
 
-            In addition, because this accesses to a critical resource,
-            a lock must be held before to call this method.
+            :return: The reply of the command
         """
-        buf = ''
-        out = []
         while True:
-            if not self.blocking:
-                data = self.tn.read_eager().decode()
-                if data == '':
-                    return None
-                buf += data
+            message = self.parse_message()
+            if message is None:
+                data = self.sock.recv(4096)
+                if not data:
+                    raise ConnectionError("OpenOCD closed the connection")
+                self.buffer += data
+            elif message.startswith('type target_'):
+                self.notifications.append(message.strip())
+                os.write(self.notify_w, b'\0')
             else:
-                buf += self.tn.read_some().decode()
-            lines = buf.splitlines()
-            if len(lines) > 1:
-                for buf in lines[:-1]:
-                    if buf:
-                        out.append(buf)
-                buf = lines[-1]
-            if buf == '> ':
-                return out
+                return message
+
+    def Readout(self):
+        """
+            Return the notifications of cpu halt
+
+            This doesn't wait for data: if no halt notification has been
+            received, this returns None.
+            Because this accesses to a critical resource, a lock must be held
+            before to call this method.
+
+            :return: A list of notifications, or None
+        """
+        try:
+            os.read(self.notify_r, 4096)
+        except BlockingIOError:
+            pass
+
+        try:
+            data = self.sock.recv(4096, socket.MSG_DONTWAIT)
+            if not data:
+                raise ConnectionError("OpenOCD closed the connection")
+            self.buffer += data
+        except BlockingIOError:
+            pass
+
+        message = self.parse_message()
+        while message is not None:
+            self.notifications.append(message.strip())
+            message = self.parse_message()
+
+        halted = [notification for notification in self.notifications
+                  if notification.endswith('halted')]
+        self.notifications = []
+        return halted or None
+
+    def Pipeline(self, commands):
+        """
+            Execute a list of commands
+
+            This sends all the commands back to back, and then reads the
+            replies, so the latency of OpenOCD is only paid once.
+
+            :param commands: A list of tuples with the command and its
+                             arguments
+            :return: A list with the output of each command, as a list of
+                     lines
+        """
+        self.acquire()
+        try:
+            self.send(commands)
+            return [self.receive().splitlines() for command in commands]
+        finally:
+            self.release()
 
     def Exec(self, Cmd, *args):
         """
             Execute a command
 
-            This works exactly like the original method except that it will
-            acquire a lock before to execute the command.
-            This protects Readout method which access to a critical resource.
+            :param Cmd: The command to execute
+            :param args: The arguments of the command
+            :return: The output of the command, as a list of lines
+        """
+        return self.Pipeline([(Cmd,) + args])[0]
+
+    def Halt(self, Timeout=None):
+        """
+            Halt the cpu
+
+            OpenOCD notifies the halt caused by this command as any other
+            one, so the notification is dropped, and Readout() doesn't report
+            it as a watchpoint or a breakpoint hit.
+
+            :param Timeout: The time to wait for the cpu to halt, in ms
         """
+        command = ('halt',) if Timeout is None else ('halt', Timeout)
         self.acquire()
-        self.blocking = True
-        line = super(OpenOCDThreadSafe, self).Exec(Cmd, *args)
-        self.blocking = False
-        self.release()
-        return line
+        try:
+            start = len(self.notifications)
+            self.send([command])
+            self.receive()
+            for i in reversed(range(start, len(self.notifications))):
+                if self.notifications[i].endswith('halted'):
+                    del self.notifications[i]
+                    break
+        finally:
+            self.release()
+
+    def Resume(self):
+        """
+            Resume the cpu
+        """
+        self.Exec('resume')
+
+    def ReadMem(self, width, address):
+        """
+            Read a word from memory
+
+            :param width: The size, in bits, of the word
+            :param address: The physical address of the word
+            :return: The value of the word
+        """
+        lines = self.Exec('read_memory', hex(address), width, 1)
+        return int(lines[0].split()[0], 0)
+
+    def WriteMem(self, width, address, value):
+        """
+            Write a word to memory
+
+            :param width: The size, in bits, of the word
+            :param address: The physical address of the word
+            :param value: The value to write
+        """
+        self.Exec(*memory_write_command(address, [value], width))
+
+    def ReadMem8(self, address):
+        return self.ReadMem(8, address)
+
+    def ReadMem16(self, address):
+        return self.ReadMem(16, address)
+
+    def ReadMem32(self, address):
+        return self.ReadMem(32, address)
+
+    def ReadMem64(self, address):
+        return self.ReadMem(64, address)
+
+    def WriteMem8(self, address, value):
+        self.WriteMem(8, address, value)
+
+    def WriteMem16(self, address, value):
+        self.WriteMem(16, address, value)
+
+    def WriteMem32(self, address, value):
+        self.WriteMem(32, address, value)
+
+    def WriteMem64(self, address, value):
+        self.WriteMem(64, address, value)
+
+    def Reg(self, name):
+        """
+            Get a cpu register
+
+            :param name: The name of register
+            :return: An OpenOCDTclRegister object
+        """
+        return OpenOCDTclRegister(self, name)
+
+    def WP(self, address, length, read, write, read_write):
+        """
+            Create a watchpoint
+
+            :param address: The start address of the watchpoint
+            :param length: The length of watchpoint, in bytes
+            :param read: True to trigger the watchpoint on read access
+            :param write: True to trigger the watchpoint on write access
+            :param read_write: True to trigger the watchpoint on any access
+            :return: An OpenOCDTclWatchpoint object
+        """
+        return OpenOCDTclWatchpoint(self, address, length, read, write,
+                                    read_write)
 
     def acquire(self):
         """
@@ -138,9 +770,14 @@ class OpenOCDThreadSafe(OpenOCD):
         """
         self.lock.release()
 
+OPENOCD_TRANSPORTS = {
+    'telnet': (OpenOCDThreadSafe, 4444),
+    'tcl': (OpenOCDTcl, 6666),
+}
+
 class RegiceOpenOCDThread(threading.Thread):
     """
-        Poll OpenOCD to get detect when the cpu stops because of a watchpoint
+        Wait for OpenOCD to detect when the cpu stops because of a watchpoint
         or a breakpoint.
         :param ocd: OpenOCD object
         :param client: OpenOCD client
@@ -150,48 +787,192 @@ class RegiceOpenOCDThread(threading.Thread):
         self.ocd = ocd
         self.client = client
         self.quit = False
+        self.shutdown_r, self.shutdown_w = os.pipe()
 
     def run(self):
         """
-            Poll the OpenOCD to detect when it stops
+            Wait for OpenOCD to detect when it stops
 
-            Poll the OpenOCD to detect when it stops to run watchpoint or
+            Wait for OpenOCD to detect when it stops to run watchpoint or
             breakpoint callback.
-            Because there is no way to detect which watchpoint has stopped the
-            cpu, only one watchpoint is supported.
+            This sleeps until data is available on the OpenOCD connection, so
+            the lock is only taken when there is something to read.
+            On halt, the watchpoints that have stopped the cpu are found using
+            RegiceOpenOCD.watchpoint_hits(), and only their callbacks are
+            executed. The cpu is resumed only if a watchpoint was hit.
+            The halt caused by the watchpoint is handled as a halt session
+            (see RegiceOpenOCD.adopt_halt()), so the accesses done by the
+            callbacks don't resume the cpu.
 
-            This stops to poll when quit attribute is set to True.
+            This stops when quit attribute is set to True and the shutdown
+            pipe is written (see join()).
         """
+        selector = selectors.DefaultSelector()
+        selector.register(self.shutdown_r, selectors.EVENT_READ)
+        for fd in self.ocd.filenos():
+            selector.register(fd, selectors.EVENT_READ)
+
         while not self.quit:
+            selector.select()
+            if self.quit:
+                break
             self.ocd.acquire()
-            lines = self.ocd.Readout()
-            self.ocd.release()
-            if lines and self.client.watchpoints:
+            try:
+                lines = self.ocd.Readout()
+            except (ConnectionError, EOFError):
+                break
+            finally:
+                self.ocd.release()
+            if not lines or not self.client.watchpoints:
+                continue
+            watchpoints = self.client.watchpoint_hits()
+            if watchpoints:
+                self.client.adopt_halt()
                 pc_address = self.ocd.Reg('pc').Read()
-                for address in self.client.watchpoints:
-                    self.client.watchpoints[address].run(pc_address)
-                self.ocd.Resume()
-            else:
-                time.sleep(0.001)
+                self.client.watchpoint_hit(watchpoints, pc_address,
+                                           self.client.resume)
+
+        selector.close()
 
     def join(self, timeout=None):
         """
             Stop and join the thread
         """
         self.quit = True
-        self.ocd.Resume()
+        os.write(self.shutdown_w, b'\0')
+        # Resume the cpu, unless a halt session is in progress
+        self.client.halt()
+        self.client.resume()
         super(RegiceOpenOCDThread, self).join(timeout)
+        if not self.is_alive():
+            os.close(self.shutdown_r)
+            os.close(self.shutdown_w)
+
+class OpenOCDHaltSession:
+    """
+        A context manager to keep the cpu halted
+
+        The sessions are reference counted by the client: the cpu is halted
+        when the first session starts, and resumed when the last one ends,
+        so the sessions could be nested.
+
+        :param client: The RegiceOpenOCD object
+        :param enabled: If False, the session doesn't halt the cpu
+    """
+    def __init__(self, client, enabled=True):
+        self.client = client
+        self.enabled = enabled
+
+    def __enter__(self):
+        if self.enabled:
+            self.client.halt()
+        return self.client
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.enabled:
+            self.client.resume()
+        return False
 
 class RegiceOpenOCD(RegiceClient):
     """
         A class derived from RegiceClient, to use OpenOCD
 
         This class provides a way to read and write memory using JTAG.
+
+        :param transport: The protocol used to talk to OpenOCD, 'telnet' or
+                          'tcl'
+        :param host: The host running OpenOCD
+        :param port: The port of OpenOCD server. If None, use the default port
+                     of transport.
+        :param halt: If False, the memory is accessed while the cpu is
+                     running, which requires a target supporting background
+                     accesses (e.g. using the AHB-AP). Use halted() to halt
+                     the cpu explicitly.
+
+        The block writes use the write_memory command, which requires
+        OpenOCD 0.12 or later.
     """
-    def __init__(self):
+    def __init__(self, transport='telnet', host='localhost', port=None,
+                 halt=True):
         super(RegiceOpenOCD, self).__init__()
-        self.ocd = OpenOCDThreadSafe()
-        RegiceOpenOCDThread(self.ocd, self).start()
+        self.max_watchpoints = None
+        self.dwt = False
+        self.halt_on_access = halt
+        self.halt_count = 0
+        self.halt_lock = threading.Lock()
+        if not transport in OPENOCD_TRANSPORTS:
+            raise ValueError("Invalid OpenOCD transport " + transport)
+        ocd_class, default_port = OPENOCD_TRANSPORTS[transport]
+        self.ocd = ocd_class(host, port or default_port)
+        self.thread = RegiceOpenOCDThread(self.ocd, self)
+        self.thread.start()
+
+    def close(self):
+        """
+            Stop polling OpenOCD
+
+            This stops the thread that detects when the cpu stops, the
+            watchpoint dispatcher if any, and the I/O thread of transport.
+        """
+        self.thread.join()
+        if self.dispatcher:
+            self.dispatcher.join()
+        close = getattr(self.ocd, 'close', None)
+        if close:
+            close()
+
+    def halt(self):
+        """
+            Halt the cpu, unless a halt session is already in progress
+        """
+        with self.halt_lock:
+            if self.halt_count == 0:
+                self.ocd.Halt(1)
+            self.halt_count += 1
+
+    def adopt_halt(self):
+        """
+            Start a halt session for a cpu that has already been halted
+
+            This is used when the cpu has been halted by a watchpoint. The
+            session must be ended by resume().
+        """
+        with self.halt_lock:
+            self.halt_count += 1
+
+    def resume(self):
+        """
+            Resume the cpu, if this ends the last halt session
+        """
+        with self.halt_lock:
+            self.halt_count -= 1
+            if self.halt_count == 0:
+                self.ocd.Resume()
+
+    def halted(self):
+        """
+            Start a halt session
+
+            This returns a context manager that halts the cpu on entry and
+            resumes it on exit. While the session is in progress, the accesses
+            don't halt and resume the cpu anymore, so a sequence of accesses
+            only pays the halt and resume once.
+            The sessions could be nested.
+
+            :return: A OpenOCDHaltSession object
+        """
+        return OpenOCDHaltSession(self)
+
+    def access(self):
+        """
+            Start a halt session for a single access
+
+            This doesn't halt the cpu if the client has been created with
+            halt set to False.
+
+            :return: A OpenOCDHaltSession object
+        """
+        return OpenOCDHaltSession(self, self.halt_on_access)
 
     def read(self, width, address):
         """
@@ -201,29 +982,71 @@ class RegiceOpenOCD(RegiceClient):
             :param address: The physical address of register to read
             :return: The value of register
         """
-        self.ocd.Halt(1)
-        ocd_read = getattr(self.ocd, 'ReadMem{}'.format(width))
-        value = ocd_read(address)
-        self.ocd.Resume()
-        return value
+        with self.access():
+            ocd_read = getattr(self.ocd, 'ReadMem{}'.format(width))
+            return ocd_read(address)
+
+    def _read_block(self, address, count, width):
+        """
+            Read a block of contiguous registers, without halting the cpu
+
+            This uses the md{b,h,w,d} commands to read the block in a single
+            command, and parses the dump returned by OpenOCD.
+
+            :param address: The physical address of the first register to read
+            :param count: The number of registers to read
+            :param width: The size, in bits, of each register
+            :return: A list of values
+        """
+        lines = self.ocd.Exec(*memory_read_command(address, count, width))
+        return parse_memory_dump_array(lines, address, count, width)
+
+    def read_block(self, address, count, width):
+        """
+            Read a block of contiguous registers
+
+            :param address: The physical address of the first register to read
+            :param count: The number of registers to read
+            :param width: The size, in bits, of each register
+            :return: A list of values
+        """
+        with self.access():
+            return self._read_block(address, count, width)
 
     def read_list(self, addresses):
         """
             Read the value of addresses listed in dict
 
+            This halts the cpu once, and reads the addresses using block
+            transfers. The commands are pipelined if the transport supports
+            it.
+
             :param dict: A dictionnary with the width as key, and the list of
                          address to read for that width
             :return: a dictionnary of value read, and with the address used as
                      key
         """
-        values = {}
-        self.ocd.Halt(1)
+        with self.access():
+            return self._read_list(addresses)
+
+    def _read_list(self, addresses):
+        """
+            Read the value of addresses listed in dict, without halting the cpu
+
+            :param dict: A dictionnary with the width as key, and the list of
+                         address to read for that width
+            :return: a dictionnary of value read, and with the address used as
+                     key
+        """
+        spans = []
         for width in addresses:
-            ocd_read = getattr(self.ocd, 'ReadMem{}'.format(width))
-            for address in addresses[width]:
-                values[address] = ocd_read(address)
-        self.ocd.Resume()
-        return values
+            for start, count in coalesce_addresses(addresses[width], width,
+                                                   self.read_gap):
+                spans.append((start, count, width))
+
+        outputs = self.ocd.Pipeline([memory_read_command(*span)
+                                     for span in spans])
+        return read_spans(addresses, spans, outputs)
 
     def write(self, width, address, value):
         """
@@ -233,11 +1056,58 @@ class RegiceOpenOCD(RegiceClient):
             :param address: The physical address of register to write
             :param value: The value to write to the register
         """
-        self.ocd.Halt(1)
-        ocd_write = getattr(self.ocd, 'WriteMem{}'.format(width))
-        value = ocd_write(address, value)
-        self.ocd.Resume()
-        return value
+        with self.access():
+            ocd_write = getattr(self.ocd, 'WriteMem{}'.format(width))
+            return ocd_write(address, value)
+
+    def _write_block(self, address, values, width):
+        """
+            Write a block of contiguous registers, without halting the cpu
+
+            This uses the write_memory command to write the block using a
+            few pipelined commands (see memory_write_commands()).
+
+            :param address: The physical address of the first register to
+                            write
+            :param values: The list of values to write
+            :param width: The size, in bits, of each register
+        """
+        self.ocd.Pipeline(memory_write_commands(address, values, width))
+
+    def write_block(self, address, values, width):
+        """
+            Write a block of contiguous registers
+
+            :param address: The physical address of the first register to
+                            write
+            :param values: The list of values to write
+            :param width: The size, in bits, of each register
+        """
+        with self.access():
+            self._write_block(address, values, width)
+
+    def write_list(self, values):
+        """
+            Write a list of values to registers
+
+            This halts the cpu once, and writes the registers using block
+            transfers. The commands are pipelined if the transport supports
+            it.
+
+            :param values: A dictionnary with the width as key, and a
+                           dictionnary of values to write for that width, with
+                           the address used as key
+        """
+        commands = []
+        for width in values:
+            stride = width // 8
+            for start, count in coalesce_addresses(values[width], width):
+                block = [values[width][start + i * stride]
+                         for i in range(count)]
+                commands += memory_write_commands(start, block, width)
+
+        with self.access():
+            self.ocd.Pipeline(commands)
 
     def watchpoint(self, address, length, access, callback, data):
         """
@@ -253,8 +1123,81 @@ class RegiceOpenOCD(RegiceClient):
             :param callback: The callback to execute when watchpoint stops cpu
             :param data: The data to pass to callback
         """
-        if self.watchpoints:
-            raise IndexError("No more than one watchpoint is supported")
-        watchpoint = WatchpointOpenOCD(self.ocd, address, length, access,
+        if self.max_watchpoints is None:
+            self.probe_dwt()
+        if len(self.watchpoints) >= self.max_watchpoints:
+            raise IndexError("No more than {} watchpoints are supported"
+                             .format(self.max_watchpoints))
+        watchpoint = WatchpointOpenOCD(self, address, length, access,
                                        callback, data)
         self.watchpoints[address] = watchpoint
+
+    def probe_dwt(self):
+        """
+            Find out the number of watchpoints supported by the cpu
+
+            This reads the number of comparators of the DWT. If the DWT is
+            not available or can't be read (e.g. the cpu is not a Cortex-M),
+            only one watchpoint is supported, and it is considered as hit
+            each time the cpu halts.
+        """
+        try:
+            ctrl = self.read(32, DWT_CTRL)
+        except (ValueError, IndexError):
+            ctrl = 0
+        self.dwt = ctrl >> DWT_CTRL_NUMCOMP_SHIFT != 0
+        self.max_watchpoints = (ctrl >> DWT_CTRL_NUMCOMP_SHIFT) or 1
+
+    def capture_context(self):
+        """
+            Read the registers to pass to callbacks on watchpoint hit
+
+            The cpu is already halted by the watchpoint, so this reads the
+            registers without halting and resuming it.
+
+            :return: a dictionnary of value read, and with the address used as
+                     key, or None if no context has been configured
+        """
+        if self.dispatcher is None or not self.dispatcher.context:
+            return None
+        return self._read_list(self.dispatcher.context)
+
+    def watchpoint_hits(self):
+        """
+            Find the watchpoints that have stopped the cpu
+
+            This must be called while the cpu is halted.
+            This reads the debug fault status to check that the cpu has been
+            stopped by the DWT, and then the comparators to find out which
+            ones have matched. The matching comparators are looked up by
+            address in the watchpoints dictionnary.
+            If the cpu has been stopped by the DWT but no comparator reports
+            the match, and only one watchpoint is registered, then it is
+            considered as hit.
+            If the DWT or the debug fault status is not available, all the
+            watchpoints are considered as hit on any halt.
+
+            :return: The list of Watchpoint objects that have been hit
+        """
+        if not self.dwt:
+            return list(self.watchpoints.values())
+        try:
+            dfsr = self.ocd.ReadMem32(DFSR)
+        except (ValueError, IndexError):
+            return list(self.watchpoints.values())
+        if dfsr & DFSR_DWTTRAP == 0:
+            return []
+        self.ocd.WriteMem32(DFSR, DFSR_DWTTRAP)
+
+        count = self.max_watchpoints or 1
+        comparators = self._read_block(DWT_COMP_BASE, count * 4, 32)
+        hits = []
+        for i in range(count):
+            comp = comparators[i * 4]
+            function = comparators[i * 4 + 2]
+            if function & DWT_FUNCTION_MATCHED and comp in self.watchpoints:
+                hits.append(self.watchpoints[comp])
+
+        if not hits and len(self.watchpoints) == 1:
+            hits = list(self.watchpoints.values())
+        return hits
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2018 BayLibre
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    This module provides clients to record and replay register accesses.
+
+    RegiceClientRecorder wraps any client, and logs every access made
+    through it. The log could be saved to a file, and RegiceClientReplay
+    serves the reads from it, without any hardware.
+"""
+
+import struct
+import sys
+from array import array
+from time import monotonic, sleep
+
+from libregice import RegiceClient
+
+RECORDING_MAGIC = b'REGICERC'
+RECORDING_VERSION = 1
+
+# magic, version, number of accesses
+RECORDING_HEADER = struct.Struct('<8sII')
+
+ACCESS_READ = 0
+ACCESS_WRITE = 1
+
+class Recording:
+    """
+        A log of register accesses
+
+        The log is stored as columns, in arrays, so a recording of millions of
+        accesses stays compact.
+    """
+    def __init__(self):
+        self.timestamps = array('d')
+        self.accesses = array('B')
+        self.widths = array('B')
+        self.addresses = array('Q')
+        self.values = array('Q')
+
+    def columns(self):
+        """
+            Return the columns of the log
+
+            :return: A tuple with the arrays of timestamps, accesses, widths,
+                     addresses and values
+        """
+        return (self.timestamps, self.accesses, self.widths, self.addresses,
+                self.values)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, timestamp, access, width, address, value):
+        """
+            Add an access to the log
+
+            :param timestamp: The time of access
+            :param access: ACCESS_READ or ACCESS_WRITE
+            :param width: The size, in bits, of the register
+            :param address: The physical address of register
+            :param value: The value read or written
+        """
+        self.timestamps.append(timestamp)
+        self.accesses.append(access)
+        self.widths.append(width)
+        self.addresses.append(address)
+        self.values.append(value)
+
+    def save(self, path):
+        """
+            Save the recording to a file
+
+            :param path: The path of file
+        """
+        with open(path, 'wb') as file:
+            file.write(RECORDING_HEADER.pack(RECORDING_MAGIC,
+                                             RECORDING_VERSION, len(self)))
+            for column in self.columns():
+                if sys.byteorder == 'big':
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                column.tofile(file)
+
+    @staticmethod
+    def load(path):
+        """
+            Load a recording from a file
+
+            :param path: The path of file
+            :return: A Recording object
+        """
+        recording = Recording()
+        with open(path, 'rb') as file:
+            header = file.read(RECORDING_HEADER.size)
+            if len(header) != RECORDING_HEADER.size:
+                raise ValueError("{}: not a recording".format(path))
+            magic, version, count = RECORDING_HEADER.unpack(header)
+            if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+                raise ValueError("{}: not a recording".format(path))
+            for column in recording.columns():
+                column.fromfile(file, count)
+                if sys.byteorder == 'big':
+                    column.byteswap()
+        return recording
+
+class RegiceClientRecorder(RegiceClient):
+    """
+        A client that logs the accesses made through another client
+
+        Every read and write is forwarded to the client, and logged with a
+        timestamp. read_list() and write_list() are forwarded as is, so the
+        client still uses its block transfers, and each register is logged
+        as a separate access.
+        The other methods of client (e.g. close() or halted()) are forwarded,
+        without being logged.
+
+        :param client: The client to record
+    """
+    def __init__(self, client):
+        super(RegiceClientRecorder, self).__init__()
+        self.client = client
+        self.recording = Recording()
+
+    def __getattr__(self, attr):
+        if attr == 'client':
+            raise AttributeError(attr)
+        return getattr(self.client, attr)
+
+    def read(self, width, address):
+        """
+            Read a register, and log the access
+
+            :param width: The size, in bits, of the register
+            :param address: The physical address of register to read
+            :return: The value of register
+        """
+        value = self.client.read(width, address)
+        self.recording.append(monotonic(), ACCESS_READ, width, address, value)
+        return value
+
+    def read_block(self, address, count, width):
+        """
+            Read a block of registers, and log an access per register
+
+            :param address: The physical address of the first register
+            :param count: The number of registers to read
+            :param width: The size, in bits, of each register
+            :return: A list of values
+        """
+        values = self.client.read_block(address, count, width)
+        timestamp = monotonic()
+        stride = width // 8
+        for i, value in enumerate(values):
+            self.recording.append(timestamp, ACCESS_READ, width,
+                                  address + i * stride, value)
+        return values
+
+    def read_list(self, addresses):
+        """
+            Read a list of registers, and log an access per register
+
+            :param addresses: A dictionnary with the width as key, and a list
+                              of addresses as value
+            :return: A dictionnary of values, with the address used as key
+        """
+        values = self.client.read_list(addresses)
+        timestamp = monotonic()
+        for width in addresses:
+            for address in addresses[width]:
+                self.recording.append(timestamp, ACCESS_READ, width, address,
+                                      values[address])
+        return values
+
+    def write(self, width, address, value):
+        """
+            Write a register, and log the access
+
+            :param width: The size, in bits, of the register
+            :param address: The physical address of register to write
+            :param value: The value to write
+        """
+        self.client.write(width, address, value)
+        self.recording.append(monotonic(), ACCESS_WRITE, width, address, value)
+
+    def write_block(self, address, values, width):
+        """
+            Write a block of registers, and log an access per register
+
+            :param address: The physical address of the first register
+            :param values: The list of values to write
+            :param width: The size, in bits, of each register
+        """
+        self.client.write_block(address, values, width)
+        timestamp = monotonic()
+        stride = width // 8
+        for i, value in enumerate(values):
+            self.recording.append(timestamp, ACCESS_WRITE, width,
+                                  address + i * stride, value)
+
+    def write_list(self, values):
+        """
+            Write a list of registers, and log an access per register
+
+            :param values: A dictionnary with the width as key, and a
+                           dictionnary of values to write for that width, with
+                           the address used as key
+        """
+        self.client.write_list(values)
+        timestamp = monotonic()
+        for width in values:
+            for address in values[width]:
+                self.recording.append(timestamp, ACCESS_WRITE, width, address,
+                                      values[width][address])
+
+    def watchpoint(self, address, length, access, callback, data):
+        """
+            Add a watchpoint to the recorded client
+
+            The watchpoint hits are not logged.
+
+            :param address: The start address of the watchpoint
+            :param length: The length of watchpoint, in bytes
+            :param access: The type of access (R/W) that trigger the watchpoint
+            :param callback: The callback to execute when watchpoint stops cpu
+            :param data: The data to pass to callback
+        """
+        return self.client.watchpoint(address, length, access, callback, data)
+
+    def enable_watchpoint(self, address):
+        """
+            Enable a watchpoint of the recorded client
+
+            :param address: The start address of the watchpoint
+        """
+        self.client.enable_watchpoint(address)
+
+    def disable_watchpoint(self, address):
+        """
+            Disable a watchpoint of the recorded client
+
+            :param address: The start address of the watchpoint
+        """
+        self.client.disable_watchpoint(address)
+
+    def delete_watchpoint(self, address):
+        """
+            Delete a watchpoint of the recorded client
+
+            :param address: The start address of the watchpoint
+        """
+        self.client.delete_watchpoint(address)
+
+    def close(self):
+        """
+            Close the recorded client, if it could be closed
+        """
+        close = getattr(self.client, 'close', None)
+        if close:
+            close()
+
+    def save(self, path):
+        """
+            Save the recording to a file
+
+            :param path: The path of file
+        """
+        self.recording.save(path)
+
+class RegiceClientReplay(RegiceClient):
+    """
+        A client that serves the reads from a recording
+
+        The reads of each address are indexed when the client is created, so
+        each read is served in constant time. Each read of an address returns
+        the next value recorded for that address, and once all of them have
+        been returned, the last one is returned again.
+        The writes are not forwarded anywhere, but are logged in the writes
+        attribute, as a Recording object.
+
+        :param recording: A Recording object, or the path of a recording file
+        :param realtime: If True, each read waits until the time it has been
+                         recorded, relative to the first access. Otherwise,
+                         the reads are served as fast as possible.
+    """
+    def __init__(self, recording, realtime=False):
+        super(RegiceClientReplay, self).__init__()
+        if isinstance(recording, str):
+            recording = Recording.load(recording)
+        self.realtime = realtime
+        self.writes = Recording()
+        self.start = None
+        self.origin = recording.timestamps[0] if len(recording) else 0.0
+
+        self.index = {}
+        self.cursors = {}
+        for i in range(len(recording)):
+            if recording.accesses[i] != ACCESS_READ:
+                continue
+            address = recording.addresses[i]
+            if not address in self.index:
+                self.index[address] = (array('d'), array('Q'))
+                self.cursors[address] = 0
+            timestamps, values = self.index[address]
+            timestamps.append(recording.timestamps[i])
+            values.append(recording.values[i])
+
+    def read(self, width, address):
+        """
+            Return the next value recorded for the address
+
+            :param width: The size, in bits, of the register
+            :param address: The physical address of register to read
+            :return: The value of register
+            :raise KeyError: if the address has never been read in recording
+        """
+        timestamps, values = self.index[address]
+        cursor = self.cursors[address]
+        if cursor + 1 < len(values):
+            self.cursors[address] = cursor + 1
+
+        if self.realtime:
+            if self.start is None:
+                self.start = monotonic()
+            delay = timestamps[cursor] - self.origin - \
+                    (monotonic() - self.start)
+            if delay > 0:
+                sleep(delay)
+        return values[cursor]
+
+    def read_list(self, addresses):
+        """
+            Return the next value recorded for each address
+
+            :param addresses: A dictionnary with the width as key, and a list
+                              of addresses as value
+            :return: A dictionnary of values, with the address used as key
+            :raise KeyError: if an address has never been read in recording
+        """
+        values = {}
+        for width in addresses:
+            for address in addresses[width]:
+                values[address] = self.read(width, address)
+        return values
+
+    def write(self, width, address, value):
+        """
+            Log a write, without forwarding it
+
+            :param width: The size, in bits, of the register
+            :param address: The physical address of register to write
+            :param value: The value to write
+        """
+        self.writes.append(monotonic(), ACCESS_WRITE, width, address, value)
@@ -0,0 +1,550 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2018 BayLibre
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    This module provides a server to share a client between processes.
+
+    Only one process could own a probe at a time. The server owns the
+    client, and the other processes use a RegiceRemoteClient to talk to it
+    over a Unix or TCP socket.
+
+    Each message is made of a header and of a payload. The request header is
+    (payload length, request id, opcode), and the response header is
+    (payload length, request id, status). A read request payload is a list
+    of (width, address) entries, and its response payload is the list of
+    values, in the same order. A write request payload is a list of
+    (width, address, value) entries. On error, the response payload is the
+    error message.
+
+    The server takes at most one request per client on each round, so a busy
+    client can't starve the others, and serves all the requests of a round
+    with at most one write_list() and one read_list() call, so the identical
+    reads requested by several clients are only performed once.
+"""
+
+import argparse
+import os
+import selectors
+import socket
+import struct
+import sys
+import threading
+from array import array
+from collections import deque
+
+from libregice.regice import RegiceClient
+
+# payload length, request id, opcode
+REQUEST_HEADER = struct.Struct('<IIB')
+# payload length, request id, status
+RESPONSE_HEADER = struct.Struct('<IIB')
+# width, address
+READ_ENTRY = struct.Struct('<IQ')
+# width, address, value
+WRITE_ENTRY = struct.Struct('<IQQ')
+
+OP_READ = 1
+OP_WRITE = 2
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+class RegiceRemoteError(Exception):
+    """
+        An exception raised if the server failed to execute a request
+
+        :param message: The error reported by the server
+    """
+    def __init__(self, message):
+        super(RegiceRemoteError, self).__init__(message)
+        self.message = message
+
+def pack_values(values):
+    """
+        Build the payload of a read response
+
+        :param values: The list of values
+        :return: The payload, as bytes
+    """
+    values = array('Q', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+def unpack_values(payload):
+    """
+        Parse the payload of a read response
+
+        :param payload: The payload
+        :return: An array of values
+    """
+    values = array('Q')
+    values.frombytes(payload)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def open_socket(address):
+    """
+        Create a socket for an address
+
+        :param address: The path of a Unix socket, or a (host, port) tuple
+        :return: A socket object
+    """
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+def recv_exact(sock, size):
+    """
+        Receive an exact number of bytes
+
+        :param sock: The socket to read from
+        :param size: The number of bytes to read
+        :return: The data read
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by server")
+        data += chunk
+    return bytes(data)
+
+class RegiceServerConnection:
+    """
+        A connection from a client to the server
+
+        :param sock: The socket of connection
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.requests = deque()
+
+    def receive(self, data):
+        """
+            Add data to the buffer, and queue the complete requests
+
+            :param data: The data received
+        """
+        self.buffer += data
+        while len(self.buffer) >= REQUEST_HEADER.size:
+            length, request_id, opcode = \
+                REQUEST_HEADER.unpack_from(self.buffer)
+            end = REQUEST_HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            payload = bytes(self.buffer[REQUEST_HEADER.size:end])
+            del self.buffer[:end]
+            self.requests.append((request_id, opcode, payload))
+
+    def send(self, request_id, status, payload=b''):
+        """
+            Send a response
+
+            :param request_id: The id of request
+            :param status: STATUS_OK or STATUS_ERROR
+            :param payload: The payload of response
+        """
+        try:
+            self.sock.sendall(RESPONSE_HEADER.pack(len(payload), request_id,
+                                                   status) + payload)
+        except OSError:
+            pass
+
+class RegiceServer:
+    """
+        A server that shares a client between many processes
+
+        A first thread accepts the connections and receives the requests, and
+        a second one executes them. Only the second thread uses the client.
+
+        :param client: The client to share, e.g. a RegiceJLink object
+        :param address: The path of a Unix socket, or a (host, port) tuple
+    """
+    def __init__(self, client, address):
+        self.client = client
+        self.sock = open_socket(address)
+        if not isinstance(address, str):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(address)
+        self.sock.listen()
+        self.address = self.sock.getsockname()
+        self.connections = []
+        self.condition = threading.Condition()
+        self.quit = False
+        self.batches = 0
+        self.requests = 0
+        self.shutdown_r, self.shutdown_w = os.pipe()
+        self.io_thread = threading.Thread(target=self.receive)
+        self.exec_thread = threading.Thread(target=self.execute)
+
+    def start(self):
+        """
+            Start to serve the requests
+        """
+        self.io_thread.start()
+        self.exec_thread.start()
+
+    def receive(self):
+        """
+            Accept the connections, and queue the requests
+
+            This runs until close() is called.
+        """
+        selector = selectors.DefaultSelector()
+        selector.register(self.shutdown_r, selectors.EVENT_READ)
+        selector.register(self.sock, selectors.EVENT_READ)
+
+        while not self.quit:
+            for key, _ in selector.select():
+                if key.fileobj is self.sock:
+                    sock, _ = self.sock.accept()
+                    connection = RegiceServerConnection(sock)
+                    selector.register(sock, selectors.EVENT_READ, connection)
+                    with self.condition:
+                        self.connections.append(connection)
+                elif key.data is not None:
+                    connection = key.data
+                    try:
+                        data = connection.sock.recv(65536)
+                    except OSError:
+                        data = b''
+                    with self.condition:
+                        if data:
+                            connection.receive(data)
+                            self.condition.notify()
+                            continue
+                        self.connections.remove(connection)
+                    selector.unregister(connection.sock)
+                    connection.sock.close()
+
+        for key in list(selector.get_map().values()):
+            if key.data is not None:
+                key.data.sock.close()
+        selector.close()
+
+    def next_batch(self):
+        """
+            Take the next request of each client
+
+            The order of clients is rotated on each round.
+
+            :return: A list of (connection, request_id, opcode, payload)
+                     tuples, or None if the server is closed
+        """
+        with self.condition:
+            while True:
+                if self.quit:
+                    return None
+                batch = [(connection,) + connection.requests.popleft()
+                         for connection in self.connections
+                         if connection.requests]
+                if batch:
+                    self.connections.append(self.connections.pop(0))
+                    return batch
+                self.condition.wait()
+
+    def execute(self):
+        """
+            Execute the requests
+
+            This runs until close() is called.
+        """
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                break
+            self.execute_batch(batch)
+
+    def execute_batch(self, batch):
+        """
+            Execute a batch of requests, and send the responses
+
+            All the writes are merged into a single write_list() call, in
+            batch order, and then all the reads are merged into a single
+            read_list() call.
+            If one of these calls fails, the requests it covers are executed
+            again one by one, so only the requests that fail get an error.
+            The writes are never executed again once write_list() succeeded.
+
+            :param batch: A list of (connection, request_id, opcode, payload)
+                          tuples
+        """
+        reads = {}
+        writes = {}
+        requests = []
+        for connection, request_id, opcode, payload in batch:
+            try:
+                if opcode == OP_READ:
+                    entries = list(READ_ENTRY.iter_unpack(payload))
+                    for width, address in entries:
+                        if not width in reads:
+                            reads[width] = set()
+                        reads[width].add(address)
+                elif opcode == OP_WRITE:
+                    entries = list(WRITE_ENTRY.iter_unpack(payload))
+                    for width, address, value in entries:
+                        if not width in writes:
+                            writes[width] = {}
+                        writes[width][address] = value
+                else:
+                    raise ValueError("Invalid opcode {}".format(opcode))
+            except (struct.error, ValueError) as error:
+                connection.send(request_id, STATUS_ERROR,
+                                str(error).encode())
+                continue
+            requests.append((connection, request_id, opcode, entries))
+
+        done = []
+        if writes:
+            write_requests = [request for request in requests
+                              if request[2] == OP_WRITE]
+            try:
+                self.client.write_list(writes)
+                done += write_requests
+            except Exception:
+                for request in write_requests:
+                    self.execute_request(*request)
+
+        values = {}
+        if reads:
+            read_requests = [request for request in requests
+                             if request[2] == OP_READ]
+            try:
+                values = self.client.read_list(
+                    {width: sorted(reads[width]) for width in reads})
+                done += read_requests
+            except Exception:
+                for request in read_requests:
+                    self.execute_request(*request)
+
+        if not done:
+            return
+        self.batches += 1
+        self.requests += len(done)
+        for connection, request_id, opcode, entries in done:
+            payload = b''
+            if opcode == OP_READ:
+                payload = pack_values([values[entry[1]] for entry in entries])
+            connection.send(request_id, STATUS_OK, payload)
+
+    def execute_request(self, connection, request_id, opcode, entries):
+        """
+            Execute a single request, and send the response
+
+            :param connection: The RegiceServerConnection object
+            :param request_id: The id of request
+            :param opcode: OP_READ or OP_WRITE
+            :param entries: The unpacked entries of request
+        """
+        try:
+            payload = b''
+            if opcode == OP_READ:
+                addresses = {}
+                for width, address in entries:
+                    if not width in addresses:
+                        addresses[width] = []
+                    addresses[width].append(address)
+                values = self.client.read_list(addresses)
+                payload = pack_values([values[entry[1]] for entry in entries])
+            else:
+                writes = {}
+                for width, address, value in entries:
+                    if not width in writes:
+                        writes[width] = {}
+                    writes[width][address] = value
+                self.client.write_list(writes)
+        except Exception as error:
+            connection.send(request_id, STATUS_ERROR, str(error).encode())
+            return
+        self.batches += 1
+        self.requests += 1
+        connection.send(request_id, STATUS_OK, payload)
+
+    def close(self):
+        """
+            Stop the server, and close the connections
+        """
+        with self.condition:
+            self.quit = True
+            self.condition.notify_all()
+        os.write(self.shutdown_w, b'\0')
+        for thread in (self.io_thread, self.exec_thread):
+            if thread.is_alive():
+                thread.join()
+        self.sock.close()
+        os.close(self.shutdown_r)
+        os.close(self.shutdown_w)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+class RegiceRemoteClient(RegiceClient):
+    """
+        A client that forwards the accesses to a RegiceServer
+
+        read_list() and write_list() are sent as a single request, and
+        read_block() and write_block() are converted to them, so a block
+        transfer only costs one round trip.
+
+        :param address: The path of a Unix socket, or a (host, port) tuple
+    """
+    def __init__(self, address):
+        super(RegiceRemoteClient, self).__init__()
+        self.sock = open_socket(address)
+        self.sock.connect(address)
+        self.lock = threading.Lock()
+        self.request_id = 0
+
+    def request(self, opcode, payload):
+        """
+            Send a request and wait for the response
+
+            :param opcode: OP_READ or OP_WRITE
+            :param payload: The payload of request
+            :return: The payload of response
+        """
+        with self.lock:
+            self.request_id = (self.request_id + 1) & 0xffffffff
+            self.sock.sendall(REQUEST_HEADER.pack(len(payload),
+                                                  self.request_id, opcode) +
+                              payload)
+            length, request_id, status = RESPONSE_HEADER.unpack(
+                recv_exact(self.sock, RESPONSE_HEADER.size))
+            payload = recv_exact(self.sock, length)
+        if request_id != self.request_id:
+            raise RegiceRemoteError("Unexpected response")
+        if status != STATUS_OK:
+            raise RegiceRemoteError(payload.decode())
+        return payload
+
+    def read(self, width, address):
+        """
+            Read a register, using a single request
+
+            :param width: The size, in bits, of the register
+            :param address: The address of register
+            :return: The value of register
+        """
+        return self.read_list({width: [address]})[address]
+
+    def read_block(self, address, count, width):
+        """
+            Read consecutive registers, using a single request
+
+            :param address: The address of first register
+            :param count: The number of registers to read
+            :param width: The size, in bits, of the registers
+            :return: A list of values
+        """
+        stride = width // 8
+        addresses = [address + i * stride for i in range(count)]
+        values = self.read_list({width: addresses})
+        return [values[address] for address in addresses]
+
+    def read_list(self, addresses):
+        """
+            Read a list of registers, using a single request
+
+            :param addresses: A dictionnary with the width as key, and a list
+                              of addresses as value
+            :return: A dictionnary with the address as key, and the value as
+                     value
+        """
+        entries = [(width, address) for width in addresses
+                   for address in addresses[width]]
+        payload = b''.join([READ_ENTRY.pack(width, address)
+                            for width, address in entries])
+        values = unpack_values(self.request(OP_READ, payload))
+        return {entry[1]: value for entry, value in zip(entries, values)}
+
+    def write(self, width, address, value):
+        """
+            Write a register, using a single request
+
+            :param width: The size, in bits, of the register
+            :param address: The address of register
+            :param value: The value to write
+        """
+        self.write_list({width: {address: value}})
+
+    def write_block(self, address, values, width):
+        """
+            Write consecutive registers, using a single request
+
+            :param address: The address of first register
+            :param values: The list of values to write
+            :param width: The size, in bits, of the registers
+        """
+        stride = width // 8
+        self.write_list({width: {address + i * stride: value
+                                 for i, value in enumerate(values)}})
+
+    def write_list(self, values):
+        """
+            Write a list of registers, using a single request
+
+            :param values: A dictionnary with the width as key, and a
+                           dictionnary of address and value as value
+        """
+        payload = b''.join([WRITE_ENTRY.pack(width, address,
+                                             values[width][address])
+                            for width in values for address in values[width]])
+        self.request(OP_WRITE, payload)
+
+    def close(self):
+        """
+            Close the connection to server
+        """
+        self.sock.close()
+
+def main():
+    """
+        Run a server, for the client selected by the arguments
+    """
+    from libregice.plugin import init_client_args, process_client_args
+    from libregice.plugin import parse_remote_address
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--listen", required=True,
+        help="Address to listen on, as a Unix socket path or host:port"
+    )
+    init_client_args(parser)
+    args = parser.parse_args()
+    address = parse_remote_address(args.listen)
+
+    server = RegiceServer(process_client_args(args), address)
+    server.start()
+    try:
+        server.exec_thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    main()
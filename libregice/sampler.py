@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2018 BayLibre
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    This module provides a register sampler.
+
+    The sampler polls a set of registers at a fixed rate, using one
+    read_list() call per tick, and stores the timestamped samples in a
+    preallocated ring buffer.
+    The delta monitor polls a set of registers too, but only reports the
+    registers, and the fields, that have changed since the previous poll.
+"""
+
+import threading
+from array import array
+from collections import namedtuple
+from time import monotonic, sleep
+
+RegisterChange = namedtuple('RegisterChange', ['timestamp', 'register',
+                                               'address', 'old', 'new',
+                                               'fields'])
+
+class RingBuffer:
+    """
+        A preallocated ring buffer of samples
+
+        Each sample is made of a timestamp and of the value of each register.
+        The samples are stored in flat arrays, and once the buffer is full,
+        the oldest samples are overwritten.
+
+        :param capacity: The maximum number of samples
+        :param count: The number of registers per sample
+    """
+    def __init__(self, capacity, count):
+        self.capacity = capacity
+        self.count = count
+        self.timestamps = array('d', [0.0]) * capacity
+        self.values = array('Q', [0]) * (capacity * count)
+        self.head = 0
+        self.size = 0
+        self.total = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp, values):
+        """
+            Add a sample to the buffer
+
+            :param timestamp: The time of sample
+            :param values: The list of register values
+        """
+        self.timestamps[self.head] = timestamp
+        start = self.head * self.count
+        self.values[start:start + self.count] = array('Q', values)
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.total += 1
+
+    def indexes(self):
+        """
+            Return the slot index of the samples, from the oldest one
+
+            :return: A range object, or a list of indexes
+        """
+        if self.size < self.capacity:
+            return range(self.size)
+        return list(range(self.head, self.capacity)) + list(range(self.head))
+
+    def get_timestamps(self):
+        """
+            Return the timestamps of samples, from the oldest one
+
+            :return: An array of timestamps
+        """
+        return array('d', [self.timestamps[i] for i in self.indexes()])
+
+    def get_values(self, register):
+        """
+            Return the values of a register, from the oldest sample
+
+            :param register: The index of register in the sample
+            :return: An array of values
+        """
+        return array('Q', [self.values[i * self.count + register]
+                           for i in self.indexes()])
+
+class RegisterSampler(threading.Thread):
+    """
+        A class to poll registers at a fixed rate
+
+        On each tick, the value of all the registers are read using a single
+        read_list() call, timestamped with a monotonic clock and stored in a
+        RingBuffer. If a tick takes longer than the period, the missed ticks
+        are skipped and counted as overruns.
+
+        :param client: The client used to read the registers
+        :param registers: A list of RegiceRegister objects to sample
+        :param rate: The target sampling rate, in Hz
+        :param capacity: The number of samples to keep
+    """
+    def __init__(self, client, registers, rate, capacity=4096):
+        super(RegisterSampler, self).__init__()
+        self.client = client
+        self.period = 1.0 / rate
+        self.quit = False
+        self.overruns = 0
+        self.order = []
+        self.addresses = {}
+        for register in registers:
+            address = register.address()
+            if not register.size in self.addresses:
+                self.addresses[register.size] = []
+            self.addresses[register.size].append(address)
+            self.order.append(address)
+        self.buffer = RingBuffer(capacity, len(self.order))
+
+    def tick(self):
+        """
+            Read the registers once, and store the sample
+        """
+        values = self.client.read_list(self.addresses)
+        self.buffer.append(monotonic(),
+                           [values[address] for address in self.order])
+
+    def run(self):
+        """
+            Sample the registers until join() is called
+        """
+        deadline = monotonic()
+        while not self.quit:
+            self.tick()
+            deadline += self.period
+            delay = deadline - monotonic()
+            if delay > 0:
+                sleep(delay)
+            else:
+                self.overruns += 1
+                deadline = monotonic()
+
+    def join(self, timeout=None):
+        """
+            Stop the sampler
+        """
+        self.quit = True
+        super(RegisterSampler, self).join(timeout)
+
+    def stats(self):
+        """
+            Return the achieved rate and jitter
+
+            This is computed from the samples in the buffer.
+
+            :return: A dictionnary with the achieved rate in Hz ('rate'),
+                     the standard deviation of the sampling period in seconds
+                     ('jitter'), the number of samples taken ('samples') and
+                     the number of overruns ('overruns')
+        """
+        timestamps = self.buffer.get_timestamps()
+        rate = 0.0
+        jitter = 0.0
+        if len(timestamps) > 1:
+            intervals = [timestamps[i + 1] - timestamps[i]
+                         for i in range(len(timestamps) - 1)]
+            mean = sum(intervals) / len(intervals)
+            if mean > 0:
+                rate = 1.0 / mean
+            jitter = (sum([(interval - mean) ** 2 for interval in intervals])
+                      / len(intervals)) ** 0.5
+        return {'rate': rate, 'jitter': jitter,
+                'samples': self.buffer.total, 'overruns': self.overruns}
+
+class DeltaMonitor:
+    """
+        A class to report the changes of registers
+
+        Each poll reads all the registers using a single read_list() call,
+        compares the values to the previous ones, and reports only the
+        registers that have changed, with the fields that have changed.
+        On the first poll, all the registers are reported, with None as old
+        value.
+        The previous values are kept per register, so the registers sharing
+        the same address (e.g. aliased peripherals) are all reported.
+
+        :param client: The client used to read the registers
+        :param registers: A list of RegiceRegister objects to monitor
+    """
+    def __init__(self, client, registers):
+        self.client = client
+        self.addresses = {}
+        self.registers = []
+        self.last = [None] * len(registers)
+        for register in registers:
+            address = register.address()
+            if not register.size in self.addresses:
+                self.addresses[register.size] = []
+            if not address in self.addresses[register.size]:
+                self.addresses[register.size].append(address)
+            fields = register.svd.fields
+            self.registers.append((str(register), address, tuple([
+                (field_name, fields[field_name].bitOffset,
+                 (1 << fields[field_name].bitWidth) - 1)
+                for field_name in fields])))
+
+    def poll(self):
+        """
+            Read the registers once, and return the changes
+
+            :return: A list of RegisterChange tuples, the fields member being
+                     a dictionnary with the name of changed fields as key, and
+                     a (old, new) tuple as value
+        """
+        values = self.client.read_list(self.addresses)
+        timestamp = monotonic()
+        changes = []
+        for index, (name, address, fields) in enumerate(self.registers):
+            new = values[address]
+            old = self.last[index]
+            if old == new:
+                continue
+            changed = {}
+            for field, offset, mask in fields:
+                new_field = (new >> offset) & mask
+                old_field = None if old is None else (old >> offset) & mask
+                if old_field != new_field:
+                    changed[field] = (old_field, new_field)
+            changes.append(RegisterChange(timestamp, name, address, old, new,
+                                          changed))
+            self.last[index] = new
+        return changes
+
+    def changes(self, period=0.0, count=None):
+        """
+            Poll the registers, and yield the changes
+
+            :param period: The time to wait between two polls, in seconds
+            :param count: The number of polls, or None to poll forever
+            :return: A generator of RegisterChange tuples
+        """
+        while count is None or count > 0:
+            for change in self.poll():
+                yield change
+            if count is not None:
+                count -= 1
+            if period:
+                sleep(period)
+
+def write_changes(changes, file):
+    """
+        Write changes to a text file
+
+        Each change is written on one line, as the timestamp, the name of
+        register, the old and new values, and the changed fields, e.g.
+        "12.000123 TEST1.TESTA 0x3 0x4 A3=3->4".
+
+        :param changes: An iterable of RegisterChange tuples
+        :param file: A file object opened in text mode
+    """
+    for change in changes:
+        old = '-' if change.old is None else hex(change.old)
+        fields = ' '.join(['{}={}->{}'.format(field, '-' if before is None
+                                              else before, after)
+                           for field, (before, after)
+                           in change.fields.items()])
+        file.write('{:.6f} {} {} {} {}\n'.format(change.timestamp,
+                                                  change.register, old,
+                                                  hex(change.new), fields))
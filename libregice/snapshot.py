@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2018 BayLibre
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    This module provides snapshots of the registers of a device.
+
+    A snapshot stores the value of many registers, ordered by address, in
+    arrays. Two snapshots could be compared, and a snapshot could be saved
+    to disk, using the trace format with a single sample.
+"""
+
+from array import array
+from time import time
+
+from libregice.sampler import RegisterChange
+from libregice.trace import TRACE_RECORD, TraceReader, trace_header
+
+class Snapshot:
+    """
+        A snapshot of registers values
+
+        :param digest: The hash of SVD tree (see svd_hash())
+        :param names: The list of register names, e.g. 'TEST1.TESTA'
+        :param addresses: The list of register addresses
+        :param widths: The list of register sizes, in bits
+        :param values: The list of register values
+        :param timestamp: The time of snapshot
+        :param svd: The SVD object, used to decode the fields, or None
+    """
+    def __init__(self, digest, names, addresses, widths, values,
+                 timestamp=None, svd=None):
+        self.digest = digest
+        self.names = list(names)
+        self.addresses = array('Q', addresses)
+        self.widths = array('B', widths)
+        self.values = array('Q', values)
+        self.timestamp = time() if timestamp is None else timestamp
+        self.svd = svd
+        self.index = {}
+        for i, name in enumerate(self.names):
+            self.index[name] = i
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        return self.values[self.index[name]]
+
+    def get_fields(self, name):
+        """
+            Return the layout of the fields of a register
+
+            :param name: The name of register, e.g. 'TEST1.TESTA'
+            :return: A list of (field, offset, mask) tuples, empty if the
+                     SVD object is not known
+        """
+        if self.svd is None:
+            return []
+        peripheral, register = name.split('.', 1)
+        fields = self.svd.peripherals[peripheral].registers[register].fields
+        return [(field_name, fields[field_name].bitOffset,
+                 (1 << fields[field_name].bitWidth) - 1)
+                for field_name in fields]
+
+    def diff(self, other):
+        """
+            Compare two snapshots
+
+            The registers are matched by name. The registers only present in
+            one snapshot are reported with None as old or new value.
+
+            :param other: The most recent Snapshot object
+            :return: A list of RegisterChange tuples, ordered by address, the
+                     fields member being a dictionnary with the name of
+                     changed fields as key, and a (old, new) tuple as value
+        """
+        changes = []
+        names = self.names + [name for name in other.names
+                              if not name in self.index]
+        for name in names:
+            old = self[name] if name in self else None
+            new = other[name] if name in other else None
+            if old == new:
+                continue
+            if name in other:
+                address = other.addresses[other.index[name]]
+            else:
+                address = self.addresses[self.index[name]]
+
+            changed = {}
+            snapshot = self if self.svd is not None else other
+            for field, offset, mask in snapshot.get_fields(name):
+                old_field = None if old is None else (old >> offset) & mask
+                new_field = None if new is None else (new >> offset) & mask
+                if old_field != new_field:
+                    changed[field] = (old_field, new_field)
+            changes.append(RegisterChange(other.timestamp, name, address, old,
+                                          new, changed))
+        changes.sort(key=lambda change: change.address)
+        return changes
+
+    def save(self, path):
+        """
+            Save the snapshot to a file
+
+            :param path: The path of file
+        """
+        with open(path, 'wb') as file:
+            file.write(trace_header(list(zip(self.names, self.addresses,
+                                             self.widths)), self.digest))
+            records = bytearray()
+            for i, value in enumerate(self.values):
+                records += TRACE_RECORD.pack(self.timestamp, i, 0, value)
+            file.write(records)
+
+    @staticmethod
+    def load(path, svd=None):
+        """
+            Load a snapshot from a file
+
+            :param path: The path of file
+            :param svd: The SVD object used to decode the fields, or None
+            :return: A Snapshot object
+        """
+        with TraceReader(path) as reader:
+            values = array('Q', [0]) * len(reader.registers)
+            timestamp = None
+            for timestamp, register, value in reader:
+                values[register] = value
+            return Snapshot(reader.digest,
+                            [register[0] for register in reader.registers],
+                            [register[1] for register in reader.registers],
+                            [register[2] for register in reader.registers],
+                            values, timestamp, svd)
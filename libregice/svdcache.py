@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2018 BayLibre
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    This module provides a persistent cache of parsed SVD files.
+
+    Parsing a large SVD file takes time, and most of the tools parse the
+    same file again and again. This stores a compact form of the resolved
+    tree (names, addresses, sizes, bit offsets and widths, access) in a
+    cache directory, keyed by the hash of the SVD file and the version of
+    the SVD parser, and rebuilds a lightweight tree from it, that could be
+    used in place of the SVD object to build a Device.
+    The lightweight tree only provides the attributes listed above (e.g.
+    there is no description nor enumerated values), so the cache must be
+    enabled explicitly.
+    The cache is stored as JSON, so loading it never executes code.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+# Must be incremented each time the serialized form changes
+SVD_CACHE_VERSION = 2
+
+def svd_parser_version():
+    """
+        Return the version of the SVD parser
+
+        :return: The version of the RegiceSVD package, or None if unknown
+    """
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        return None
+    try:
+        return version('RegiceSVD')
+    except PackageNotFoundError:
+        return None
+
+def svd_cache_dir():
+    """
+        Return the default cache directory
+
+        :return: The path of cache directory
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'regice')
+
+class SVDCacheField:
+    """
+        A field rebuilt from cache
+
+        :param parent: The SVDCacheRegister object that owns the field
+        :param field: The serialized field
+    """
+    def __init__(self, parent, field):
+        self.parent = parent
+        self.name, self.bitOffset, self.bitWidth, self.access = field
+
+class SVDCacheRegister:
+    """
+        A register rebuilt from cache
+
+        :param parent: The SVDCachePeripheral object that owns the register
+        :param register: The serialized register
+    """
+    def __init__(self, parent, register):
+        self.parent = parent
+        self.name, self.addressOffset, self.size, self.access, \
+            fields = register
+        self.fields = {}
+        for field in fields:
+            self.fields[field[0]] = SVDCacheField(self, field)
+
+    def address(self):
+        """
+            Return the address of register
+
+            :return: the address of register
+        """
+        return self.parent.baseAddress + self.addressOffset
+
+class SVDCachePeripheral:
+    """
+        A peripheral rebuilt from cache
+
+        :param parent: The SVDCacheDevice object that owns the peripheral
+        :param peripheral: The serialized peripheral
+    """
+    def __init__(self, parent, peripheral):
+        self.parent = parent
+        self.name, self.baseAddress, registers = peripheral
+        self.registers = {}
+        for register in registers:
+            self.registers[register[0]] = SVDCacheRegister(self, register)
+
+class SVDCacheDevice:
+    """
+        A device rebuilt from cache
+
+        This provides the subset of the SVD object used by Device.
+
+        :param device: The serialized device
+        :param digest: The hash of the SVD file
+    """
+    def __init__(self, device, digest=None):
+        self.name, peripherals = device
+        self.digest = digest
+        self.peripherals = {}
+        for peripheral in peripherals:
+            self.peripherals[peripheral[0]] = SVDCachePeripheral(self,
+                                                                 peripheral)
+
+def svd_serialize(svd):
+    """
+        Build the compact form of a SVD tree
+
+        :param svd: The SVD object to serialize
+        :return: A tree of tuples
+    """
+    peripherals = []
+    for peripheral in svd.peripherals.values():
+        registers = []
+        for register in peripheral.registers.values():
+            fields = tuple([(field.name, field.bitOffset, field.bitWidth,
+                             getattr(field, 'access', None))
+                            for field in register.fields.values()])
+            registers.append((register.name, register.addressOffset,
+                              register.size, getattr(register, 'access', None),
+                              fields))
+        peripherals.append((peripheral.name, peripheral.baseAddress,
+                            tuple(registers)))
+    return (svd.name, tuple(peripherals))
+
+def svd_digest(data):
+    """
+        Compute the key of a SVD file in cache
+
+        The key depends on the content of SVD file, the version of the SVD
+        parser and the version of the serialized form.
+
+        :param data: The content of SVD file
+        :return: The key, as an hexadecimal string
+    """
+    digest = hashlib.sha256()
+    digest.update(str(SVD_CACHE_VERSION).encode())
+    digest.update(str(svd_parser_version()).encode())
+    digest.update(data)
+    return digest.hexdigest()
+
+def svd_hash(svd):
+    """
+        Compute the hash of a SVD tree
+
+        This only depends on the resolved tree, so a SVD object and the
+        SVDCacheDevice object rebuilt from it have the same hash.
+
+        :param svd: The SVD object, or the SVDCacheDevice object
+        :return: The hash, as a 32 bytes digest
+    """
+    return hashlib.sha256(repr(svd_serialize(svd)).encode()).digest()
+
+def load_svd_cached(name, cache_dir=None):
+    """
+        Load a SVD file, using the cache if possible
+
+        If the SVD file has already been parsed, this rebuilds the tree from
+        cache without parsing the file. Otherwise, this parses the file and
+        stores the tree in cache.
+        In both cases, a SVDCacheDevice object is returned, so the caller
+        gets the same attributes whether the cache has been hit or not.
+        If name is not a path to a file (e.g. a resource name), then the cache
+        is not used, and the SVD object is returned.
+
+        :param name: The SVD file to load
+        :param cache_dir: The cache directory. If None, use svd_cache_dir()
+        :return: A SVDCacheDevice object, or a SVD object
+    """
+    # Imported here so libregice could be imported without regicecommon
+    from regicecommon.helpers import load_svd
+
+    if not os.path.isfile(name):
+        return load_svd(name)
+
+    with open(name, 'rb') as file:
+        digest = svd_digest(file.read())
+
+    if cache_dir is None:
+        cache_dir = svd_cache_dir()
+    path = os.path.join(cache_dir, digest + '.json')
+    try:
+        with open(path, 'r') as file:
+            return SVDCacheDevice(json.load(file), digest)
+    except (OSError, TypeError, ValueError):
+        pass
+
+    tree = svd_serialize(load_svd(name))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'w') as file:
+            json.dump(tree, file, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return SVDCacheDevice(tree, digest)
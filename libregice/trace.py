@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2018 BayLibre
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    This module provides a binary trace format for register captures.
+
+    A trace file starts with a header, made of a magic string, the format
+    version, the hash of the SVD tree and a table of the traced registers.
+    It is followed by fixed-width records, each one made of a timestamp,
+    the index of register in the table and the value.
+    The records are only appended, and the reader memory-maps the file, so
+    the columns could be used as NumPy arrays without copying nor parsing
+    the records.
+"""
+
+import mmap
+import os
+import struct
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from libregice.svdcache import svd_hash
+
+TRACE_MAGIC = b'REGICETR'
+TRACE_VERSION = 1
+
+# magic, version, number of registers, svd hash
+TRACE_HEADER = struct.Struct('<8sII32s')
+# address, width, length of name
+TRACE_REGISTER = struct.Struct('<QII')
+# timestamp, register index, padding, value
+TRACE_RECORD = struct.Struct('<dIIQ')
+
+if numpy is not None:
+    TRACE_DTYPE = numpy.dtype([('timestamp', '<f8'), ('register', '<u4'),
+                               ('padding', '<u4'), ('value', '<u8')])
+
+class InvalidTrace(Exception):
+    """
+        An exception raised if a file is not a valid trace
+
+        :param path: The path of the file
+        :param reason: Why the file is not valid
+    """
+    def __init__(self, path, reason):
+        super(InvalidTrace, self).__init__()
+        self.path = path
+        self.reason = reason
+
+    def __str__(self):
+        return "{}: {}".format(self.path, self.reason)
+
+def trace_header(registers, digest):
+    """
+        Build the header of a trace file
+
+        The header is padded, so the records are aligned on 8 bytes.
+
+        :param registers: A list of (name, address, width) tuples
+        :param digest: The hash of SVD tree
+        :return: The header, as bytes
+    """
+    header = bytearray(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION,
+                                         len(registers), digest))
+    for name, address, width in registers:
+        name = name.encode()
+        header += TRACE_REGISTER.pack(address, width, len(name)) + name
+    header += bytes(-len(header) % 8)
+    return bytes(header)
+
+def parse_trace_header(path, data):
+    """
+        Parse the header of a trace file
+
+        :param path: The path of the file, used to report errors
+        :param data: The content of file, or at least its header
+        :return: A (registers, digest, size) tuple, registers being a list
+                 of (name, address, width) tuples, and size the size of
+                 header
+    """
+    if len(data) < TRACE_HEADER.size:
+        raise InvalidTrace(path, "file too short")
+    magic, version, count, digest = TRACE_HEADER.unpack_from(data)
+    if magic != TRACE_MAGIC:
+        raise InvalidTrace(path, "not a trace file")
+    if version != TRACE_VERSION:
+        raise InvalidTrace(path, "unsupported version {}".format(version))
+
+    registers = []
+    offset = TRACE_HEADER.size
+    for _ in range(count):
+        if offset + TRACE_REGISTER.size > len(data):
+            raise InvalidTrace(path, "truncated register table")
+        address, width, length = TRACE_REGISTER.unpack_from(data, offset)
+        offset += TRACE_REGISTER.size
+        name = bytes(data[offset:offset + length]).decode()
+        offset += length
+        registers.append((name, address, width))
+    offset += -offset % 8
+    return registers, digest, offset
+
+class TraceWriter:
+    """
+        A class to append register values to a trace file
+
+        If the file already exists, the records are appended to it, but only
+        if it has been created for the same registers and SVD tree.
+
+        :param path: The path of trace file
+        :param svd: The SVD object, used to compute the hash stored in header
+        :param registers: A list of RegiceRegister objects to trace
+    """
+    def __init__(self, path, svd, registers):
+        self.path = path
+        self.registers = [(str(register), register.address(), register.size)
+                          for register in registers]
+        self.ids = {}
+        for index, (name, address, width) in enumerate(self.registers):
+            self.ids[address] = index
+
+        header = trace_header(self.registers, svd_hash(svd))
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(header)
+            return
+
+        with open(path, 'rb') as file:
+            data = file.read(len(header))
+        if data != header:
+            self.file.close()
+            raise InvalidTrace(path, "the trace has been created for "
+                               "another register table or SVD")
+        size = self.file.tell() - len(header)
+        if size % TRACE_RECORD.size:
+            # Drop the last record, partially written
+            self.file.truncate(self.file.tell() - size % TRACE_RECORD.size)
+            self.file.seek(0, os.SEEK_END)
+
+    def append(self, timestamp, address, value):
+        """
+            Append a record
+
+            :param timestamp: The time of sample
+            :param address: The address of register
+            :param value: The value of register
+        """
+        self.file.write(TRACE_RECORD.pack(timestamp, self.ids[address], 0,
+                                          value))
+
+    def append_sample(self, timestamp, values):
+        """
+            Append the value of several registers, sampled at once
+
+            :param timestamp: The time of sample
+            :param values: A dictionnary with the address of register as key,
+                           and the value of register as value, as returned
+                           by read_list()
+        """
+        records = bytearray()
+        for address in values:
+            if address in self.ids:
+                records += TRACE_RECORD.pack(timestamp, self.ids[address], 0,
+                                             values[address])
+        self.file.write(records)
+
+    def append_changes(self, changes):
+        """
+            Append the changes reported by a DeltaMonitor
+
+            :param changes: An iterable of RegisterChange tuples
+        """
+        for change in changes:
+            self.append(change.timestamp, change.address, change.new)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class TraceReader:
+    """
+        A class to read a trace file
+
+        The file is memory-mapped. If NumPy is available, the columns are
+        NumPy views on the mapped file, and are not copied. Otherwise, the
+        columns are copied into arrays.
+
+        :param path: The path of trace file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.mmap = None
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size:
+                self.mmap = mmap.mmap(file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+        data = self.mmap if self.mmap is not None else b''
+        self.registers, self.digest, self.offset = \
+            parse_trace_header(path, data)
+        self.count = max(size - self.offset, 0) // TRACE_RECORD.size
+        self.records = None
+        if numpy is not None:
+            self.records = numpy.frombuffer(self.mmap, dtype=TRACE_DTYPE,
+                                            count=self.count,
+                                            offset=self.offset)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        end = self.offset + self.count * TRACE_RECORD.size
+        records = TRACE_RECORD.iter_unpack(self.mmap[self.offset:end])
+        for timestamp, register, _, value in records:
+            yield timestamp, register, value
+
+    def register_id(self, name):
+        """
+            Return the index of a register in the register table
+
+            :param name: The name of register, e.g. 'TEST1.TESTA'
+            :return: The index of register
+        """
+        for index, register in enumerate(self.registers):
+            if register[0] == name:
+                return index
+        raise KeyError(name)
+
+    def column(self, name):
+        """
+            Return a column of the records
+
+            :param name: The name of column ('timestamp', 'register' or
+                         'value')
+            :return: A NumPy view, or an array if NumPy is not available
+        """
+        if self.records is not None:
+            return self.records[name]
+        index = ('timestamp', 'register', 'value').index(name)
+        return array('dIQ'[index], [record[index] for record in self])
+
+    @property
+    def timestamps(self):
+        return self.column('timestamp')
+
+    @property
+    def ids(self):
+        return self.column('register')
+
+    @property
+    def values(self):
+        return self.column('value')
+
+    def get_register(self, name):
+        """
+            Return the samples of a register
+
+            :param name: The name of register, e.g. 'TEST1.TESTA'
+            :return: A (timestamps, values) tuple
+        """
+        register = self.register_id(name)
+        if self.records is not None:
+            records = self.records[self.records['register'] == register]
+            return records['timestamp'], records['value']
+        timestamps = array('d')
+        values = array('Q')
+        for timestamp, index, value in self:
+            if index == register:
+                timestamps.append(timestamp)
+                values.append(value)
+        return timestamps, values
+
+    def close(self):
+        """
+            Unmap the file
+
+            The file stays mapped while NumPy views on it are still alive.
+        """
+        self.records = None
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# MIT License
+#
+# Copyright (c) 2018 BayLibre
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    Measure the memory used by the Device tree of a large SVD.
+
+    This builds a synthetic SVD tree, materializes the whole Device tree
+    and reports the memory allocated for it.
+"""
+
+import argparse
+import tracemalloc
+
+from libregice import RegiceClientTest
+from libregice.device import Device
+from libregice.svdcache import SVDCacheDevice
+
+def large_svd(peripherals, registers, fields):
+    """
+        Build a synthetic SVD tree
+
+        :param peripherals: The number of peripherals
+        :param registers: The number of registers per peripheral
+        :param fields: The number of fields per register
+        :return: A SVDCacheDevice object
+    """
+    tree = []
+    for i in range(peripherals):
+        regs = []
+        for j in range(registers):
+            regs.append(('REG{}'.format(j), j * 4, 32, 'read-write',
+                         tuple([('F{}'.format(k), k, 1, 'read-write')
+                                for k in range(fields)])))
+        tree.append(('PERIPH{}'.format(i), 0x40000000 + i * 0x1000,
+                     tuple(regs)))
+    return SVDCacheDevice(('LARGE', tuple(tree)))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peripherals", type=int, default=100)
+    parser.add_argument("--registers", type=int, default=50)
+    parser.add_argument("--fields", type=int, default=8)
+    args = parser.parse_args()
+
+    svd = large_svd(args.peripherals, args.registers, args.fields)
+    tracemalloc.start()
+    dev = Device(svd, RegiceClientTest())
+    dev.regice_init()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    count = args.peripherals * args.registers * (args.fields + 1)
+    print("{} objects: {} KiB ({:.1f} bytes per register or field)".format(
+        count, size // 1024, size / count))
+
+if __name__ == '__main__':
+    main()
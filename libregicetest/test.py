@@ -23,21 +23,155 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import asyncio
+import os
+import shutil
+import socket
 import sys
+import tempfile
+import threading
 import unittest
 
 from libregice import Regice, RegiceClient, RegiceClientTest, RegisterSimulation
 from libregice import InvalidRegister, Watchpoint
-from libregice.device import Device, RegiceRegister
+from libregice import RegiceClientRecorder, RegiceClientReplay
+from libregice import RegiceRemoteClient, RegiceServer
+from libregice.regiceremote import OP_READ, READ_ENTRY, REQUEST_HEADER
+from libregice.regiceremote import OP_WRITE, WRITE_ENTRY
+from libregice.regiceremote import RESPONSE_HEADER, RegiceRemoteError
+from libregice.regiceremote import RegiceServerConnection, STATUS_OK
+from libregice.regiceremote import unpack_values
+from libregice.regice import InvalidField, InvalidPeripheral
+from libregice.device import Device, RegicePeripheral, RegiceRegister
+from libregice.fleet import Fleet
+from libregice.regice import coalesce_addresses
+from libregice.regiceopenocd import OpenOCDTcl, RegiceOpenOCD
+from libregice.regiceopenocd import OpenOCDThreadSafe, parse_memory_dump_array
+from libregice.regiceopenocd import memory_write_commands
+from libregice.regiceasync import AsyncRegiceClientAdapter, AsyncRegiceOpenOCD
+from libregice.sampler import DeltaMonitor, RegisterSampler, RingBuffer
+from libregice.sampler import write_changes
+from libregice.snapshot import Snapshot
+from libregice.svdcache import SVDCacheDevice, load_svd_cached, svd_serialize
+from libregice.svdcache import svd_hash
+from libregice.trace import InvalidTrace, TraceReader, TraceWriter
+from libregice.regiceopenocd import DFSR, DFSR_DWTTRAP, DWT_CTRL
+from libregice.regiceopenocd import DWT_COMP_BASE, DWT_FUNCTION_MATCHED
 from regicecommon.helpers import load_svd
 from regicecommon.pkg import open_resource
 from regicetest import open_svd_file
 from svd import SVDText
-from time import sleep
+from array import array
+from io import StringIO
+from time import sleep, time
+from types import SimpleNamespace
 
 def watchpoint_cb(address, unittest):
     unittest.value += 1
 
+def watchpoint_context_cb(address, unittest, context):
+    unittest.context = context
+    unittest.value += 1
+
+class OpenOCDTclServer(threading.Thread):
+    """
+        A fake OpenOCD TCL RPC server
+
+        This emulates the framing of TCL RPC protocol, and the few commands
+        used by libregice, on top of the memory of a RegiceClientTest.
+    """
+    def __init__(self):
+        super(OpenOCDTclServer, self).__init__(daemon=True)
+        self.memory = RegiceClientTest().memory
+        self.commands = []
+        self.errors = set()
+        self.server = socket.socket()
+        self.server.bind(('localhost', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.conn = None
+        self.connected = threading.Event()
+
+    def notify(self, event):
+        self.conn.sendall('type target_event event {}\r\n\x1a'
+                          .format(event).encode())
+
+    def execute(self, command):
+        self.commands.append(command)
+        args = command.split()
+        if args[0] in self.errors:
+            return 'Error: {} failed'.format(args[0])
+        if args[0] in ['mdw', 'mdh', 'mdb']:
+            address = int(args[1], 0)
+            if address in self.errors:
+                return 'Error: failed to read memory'
+            words = ['{:08x}'.format(self.memory.get(address + i * 4, 0))
+                     for i in range(int(args[2]))]
+            return '0x{:08x}: {}\n'.format(address, ' '.join(words))
+        if args[0] == 'read_memory':
+            if int(args[1], 0) in self.errors:
+                return 'Error: failed to read memory'
+            return hex(self.memory.get(int(args[1], 0), 0))
+        if args[0] == 'mww':
+            self.memory[int(args[1], 0)] = int(args[2], 0)
+        if args[0] == 'write_memory':
+            address = int(args[1], 0)
+            for word in command.split('{')[1].rstrip('}').split():
+                self.memory[address] = int(word, 0)
+                address += 4
+        if args[0] == 'reg':
+            return 'pc (/32): 0x00000100'
+        if args[0] == 'halt':
+            self.notify('halted')
+        return ''
+
+    def serve(self, conn):
+        buf = b''
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            buf += data
+            while b'\x1a' in buf:
+                command, buf = buf.split(b'\x1a', 1)
+                reply = self.execute(command.decode())
+                conn.sendall(reply.encode() + b'\x1a')
+
+    def run(self):
+        while True:
+            self.conn, addr = self.server.accept()
+            self.connected.set()
+            threading.Thread(target=self.serve, args=(self.conn,),
+                             daemon=True).start()
+
+class OpenOCDTelnetServer(OpenOCDTclServer):
+    """
+        A fake OpenOCD telnet server
+
+        This emulates the echo and the prompt of the telnet console.
+        The replies are sent in chunks of chunk bytes.
+    """
+    chunk = 4096
+
+    def notify(self, event):
+        self.conn.sendall('target {}\r\n> '.format(event).encode())
+
+    def serve(self, conn):
+        conn.sendall(b'Open On-Chip Debugger\r\n> ')
+        buf = b''
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            buf += data
+            while b'\n' in buf:
+                command, buf = buf.split(b'\n', 1)
+                command = command.decode()
+                reply = self.execute(command)
+                data = '{}\r\n{}\r\n> '.format(command, reply).encode()
+                for i in range(0, len(data), self.chunk):
+                    conn.sendall(data[i:i + self.chunk])
+
 class TestRegiceClientTest(unittest.TestCase):
     @classmethod
     def setUpClass(self):
@@ -63,6 +197,365 @@ class TestRegiceClientTest(unittest.TestCase):
         values = self.client.read_list(addresses)
         self.assertEqual(values, self.memory)
 
+    def test_read_block(self):
+        address = min(self.memory.keys())
+        values = self.client.read_block(address, 3, 32)
+        self.assertEqual(values, [self.memory[address],
+                                  self.memory[address + 4],
+                                  self.memory[address + 8]])
+
+    def test_read_list_coalesced(self):
+        self.client.block_reads = 0
+        addresses = {32: [0x0000123c, 0x00001234, 0x00001238]}
+        values = self.client.read_list(addresses)
+        self.assertEqual(values, self.memory)
+        self.assertEqual(self.client.block_reads, 1)
+
+    def test_write_block(self):
+        address = min(self.memory.keys())
+        self.client.write_block(address, [1, 2], 32)
+        self.assertEqual(self.memory[address], 1)
+        self.assertEqual(self.memory[address + 4], 2)
+
+    def test_write_list(self):
+        self.client.block_writes = 0
+        values = {32: {0x0000123c: 3, 0x00001234: 1, 0x00001238: 2}}
+        self.client.write_list(values)
+        self.assertEqual(self.memory[0x00001234], 1)
+        self.assertEqual(self.memory[0x00001238], 2)
+        self.assertEqual(self.memory[0x0000123c], 3)
+        self.assertEqual(self.client.block_writes, 1)
+
+    def test_coalesce_addresses(self):
+        spans = coalesce_addresses([0x108, 0x100, 0x104, 0x110], 32)
+        self.assertEqual(spans, [(0x100, 3), (0x110, 1)])
+
+        spans = coalesce_addresses([0x108, 0x100, 0x104, 0x110], 32, 1)
+        self.assertEqual(spans, [(0x100, 5)])
+
+        spans = coalesce_addresses([0x100, 0x102, 0x104], 32, 4)
+        self.assertEqual(spans, [(0x100, 1), (0x102, 1), (0x104, 1)])
+
+        self.assertEqual(coalesce_addresses([], 32), [])
+
+class TestOpenOCDThreadSafe(unittest.TestCase):
+    def setUp(self):
+        self.server = OpenOCDTelnetServer()
+        self.server.start()
+        self.ocd = OpenOCDThreadSafe('localhost', self.server.port)
+        self.server.connected.wait()
+
+    def tearDown(self):
+        self.ocd.close()
+
+    def test_exec(self):
+        lines = self.ocd.Exec('mdw', '0x1234', 2)
+        self.assertEqual(lines, ['mdw 0x1234 2',
+                                 '0x00001234: 00100003 00010000'])
+
+    def test_pipeline(self):
+        outputs = self.ocd.Pipeline([('mww', '0x1234', '0x1'),
+                                     ('mdw', '0x1234', 1),
+                                     ('mdw', '0x1238', 1)])
+        self.assertEqual(outputs[1][-1], '0x00001234: 00000001')
+        self.assertEqual(outputs[2][-1], '0x00001238: 00010000')
+
+    def test_large_dump(self):
+        self.server.chunk = 7
+        lines = self.ocd.Exec('mdw', '0x1234', 1024)
+        values = parse_memory_dump_array(lines, 0x1234, 1024, 32)
+        self.assertEqual(len(values), 1024)
+        self.assertEqual(values[0], 0x00100003)
+        self.assertEqual(values[1], 0x00010000)
+
+    def test_parse_memory_dump_array(self):
+        lines = ['mdb 0x1000 6', '0x00001000: 01 02 03 04',
+                 '0x00001004: 05 06']
+        values = parse_memory_dump_array(lines, 0x1000, 6, 8)
+        self.assertEqual(list(values), [1, 2, 3, 4, 5, 6])
+        with self.assertRaises(ValueError):
+            parse_memory_dump_array(lines, 0x1000, 8, 8)
+
+    def test_concurrent(self):
+        results = {}
+
+        def read(address):
+            results[address] = self.ocd.Exec('mdw', hex(address), 1)[-1]
+
+        threads = [threading.Thread(target=read, args=(0x1234 + i * 4,))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for address, line in results.items():
+            self.assertTrue(line.startswith('0x{:08x}:'.format(address)))
+
+    def test_write_memory(self):
+        values = list(range(100))
+        commands = memory_write_commands(0x1000, values, 32)
+        self.assertEqual(len(commands), 2)
+        self.assertEqual(commands[1][1], hex(0x1000 + 64 * 4))
+        self.ocd.Pipeline(commands)
+        self.assertEqual(self.server.memory[0x1000 + 99 * 4], 99)
+
+    def test_close(self):
+        ocd = OpenOCDThreadSafe('localhost', self.server.port)
+        ocd.close()
+        with self.assertRaises(ConnectionError):
+            ocd.Exec('mdw', '0x1234', 1)
+
+    def test_readout(self):
+        self.assertEqual(self.ocd.Readout(), None)
+        self.server.notify('halted')
+        for i in range(100):
+            lines = self.ocd.Readout()
+            if lines:
+                break
+            sleep(0.01)
+        self.assertEqual(lines, ['target halted'])
+
+class TestOpenOCDTcl(unittest.TestCase):
+    def setUp(self):
+        self.server = OpenOCDTclServer()
+        self.server.start()
+        self.ocd = OpenOCDTcl('localhost', self.server.port)
+        self.server.connected.wait()
+
+    def test_exec(self):
+        self.assertEqual(self.ocd.ReadMem32(0x00001234), 0x00100003)
+        self.ocd.WriteMem32(0x00001234, 5)
+        self.assertEqual(self.server.memory[0x00001234], 5)
+        self.assertEqual(self.ocd.Reg('pc').Read(), 0x100)
+
+    def test_pipeline(self):
+        outputs = self.ocd.Pipeline([('mww', '0x1234', '0x1'),
+                                     ('mdw', '0x1234', 2)])
+        self.assertEqual(outputs[1], ['0x00001234: 00000001 00010000'])
+
+    def test_readout(self):
+        self.ocd.acquire()
+        self.assertEqual(self.ocd.Readout(), None)
+        self.server.notify('resumed')
+        self.server.notify('halted')
+        sleep(0.1)
+        lines = self.ocd.Readout()
+        self.ocd.release()
+        self.assertEqual(lines, ['type target_event event halted'])
+
+    def test_client(self):
+        client = RegiceOpenOCD('tcl', 'localhost', self.server.port)
+        values = client.read_list({32: [0x00001234, 0x00001238, 0x0000123c]})
+        self.assertEqual(values[0x00001238], 0x00010000)
+        client.write_list({32: {0x00001234: 1, 0x00001238: 2}})
+        self.assertEqual(self.server.memory[0x00001238], 2)
+        self.assertIn('write_memory 0x1234 32 {0x1 0x2}', self.server.commands)
+        client.close()
+
+    def test_client_halted(self):
+        client = RegiceOpenOCD('tcl', 'localhost', self.server.port)
+        del self.server.commands[:]
+        with client.halted():
+            client.read(32, 0x00001234)
+            with client.halted():
+                client.read_list({32: [0x00001234, 0x00001238]})
+            client.write(32, 0x00001234, 1)
+        self.assertEqual(self.server.commands.count('halt 1'), 1)
+        self.assertEqual(self.server.commands.count('resume'), 1)
+        self.assertEqual(self.server.commands[-1], 'resume')
+        client.close()
+
+    def test_client_halted_watchpoint(self):
+        client = RegiceOpenOCD('tcl', 'localhost', self.server.port)
+        client.watchpoint(0x00001234, 4, Watchpoint.RW, watchpoint_cb, self)
+        del self.server.commands[:]
+        with client.halted():
+            client.enable_watchpoint(0x00001234)
+            client.disable_watchpoint(0x00001234)
+            self.assertNotIn('resume', self.server.commands)
+        self.assertEqual(self.server.commands.count('halt 1'), 1)
+        self.assertEqual(self.server.commands[-1], 'resume')
+        client.close()
+
+    def test_client_no_halt(self):
+        client = RegiceOpenOCD('tcl', 'localhost', self.server.port,
+                               halt=False)
+        del self.server.commands[:]
+        client.read(32, 0x00001234)
+        client.write_list({32: {0x00001234: 1}})
+        self.assertNotIn('halt 1', self.server.commands)
+        with client.halted():
+            client.read(32, 0x00001234)
+        self.assertEqual(self.server.commands.count('halt 1'), 1)
+        client.close()
+
+    def wait_value(self, obj):
+        for i in range(100):
+            if obj.value:
+                break
+            sleep(0.01)
+
+    def test_client_watchpoint(self):
+        self.value = 0
+        self.server.memory[DFSR] = DFSR_DWTTRAP
+        client = RegiceOpenOCD('tcl', 'localhost', self.server.port)
+        client.watchpoint(0x00001234, 4, Watchpoint.RW, watchpoint_cb, self)
+        client.enable_watchpoint(0x00001234)
+        self.assertIn('wp 0x1234 4 a', self.server.commands)
+
+        self.server.notify('halted')
+        self.wait_value(self)
+        self.assertEqual(self.value, 1)
+        client.close()
+        self.assertFalse(client.thread.is_alive())
+
+    def test_client_watchpoint_dispatch(self):
+        self.value = 0
+        self.server.memory[DFSR] = DFSR_DWTTRAP
+        client = RegiceOpenOCD('tcl', 'localhost', self.server.port)
+        client.watchpoint_dispatch(resume=True, context={32: [0x00001238]})
+        client.watchpoint(0x00001234, 4, Watchpoint.RW, watchpoint_context_cb,
+                          self)
+
+        self.server.notify('halted')
+        self.wait_value(self)
+        self.assertEqual(self.value, 1)
+        self.assertEqual(self.context, {0x00001238: 0x00010000})
+        client.close()
+
+    def test_client_watchpoints(self):
+        self.value = 0
+        other = SimpleNamespace(value=0)
+        self.server.memory[DWT_CTRL] = 2 << 28
+        client = RegiceOpenOCD('tcl', 'localhost', self.server.port)
+        client.watchpoint(0x00001234, 4, Watchpoint.RW, watchpoint_cb, self)
+        client.watchpoint(0x00001238, 4, Watchpoint.RW, watchpoint_cb, other)
+        with self.assertRaises(IndexError):
+            client.watchpoint(0x0000123c, 4, Watchpoint.RW, watchpoint_cb,
+                              self)
+
+        self.server.memory[DFSR] = DFSR_DWTTRAP
+        self.server.memory[DWT_COMP_BASE] = 0x00001234
+        self.server.memory[DWT_COMP_BASE + 16] = 0x00001238
+        self.server.memory[DWT_COMP_BASE + 24] = DWT_FUNCTION_MATCHED
+        self.server.notify('halted')
+        self.wait_value(other)
+        self.assertEqual(other.value, 1)
+        self.assertEqual(self.value, 0)
+        client.close()
+
+    def test_client_watchpoint_no_dwt(self):
+        self.value = 0
+        self.server.errors.add(DWT_CTRL)
+        client = RegiceOpenOCD('tcl', 'localhost', self.server.port)
+        client.watchpoint(0x00001234, 4, Watchpoint.RW, watchpoint_cb, self)
+        with self.assertRaises(IndexError):
+            client.watchpoint(0x00001238, 4, Watchpoint.RW, watchpoint_cb,
+                              self)
+
+        self.server.notify('halted')
+        self.wait_value(self)
+        self.assertEqual(self.value, 1)
+        self.assertNotIn('read_memory {} 32 1'.format(hex(DFSR)),
+                         self.server.commands)
+        client.close()
+
+    def test_client_own_halt(self):
+        self.value = 0
+        self.server.memory[DWT_CTRL] = 2 << 28
+        client = RegiceOpenOCD('tcl', 'localhost', self.server.port)
+        client.watchpoint(0x00001234, 4, Watchpoint.RW, watchpoint_cb, self)
+        client.read(32, 0x00001234)
+        sleep(0.1)
+        self.assertNotIn('read_memory {} 32 1'.format(hex(DFSR)),
+                         self.server.commands)
+        self.assertEqual(self.value, 0)
+        client.close()
+
+class TestAsyncRegiceOpenOCD(unittest.TestCase):
+    def setUp(self):
+        self.server = OpenOCDTclServer()
+        self.server.start()
+
+    def test_client(self):
+        async def run():
+            client = await AsyncRegiceOpenOCD.connect('localhost',
+                                                      self.server.port)
+            values, value = await asyncio.gather(
+                client.read_list({32: [0x00001234, 0x00001238]}),
+                client.read(32, 0x0000123c))
+            self.assertEqual(values[0x00001238], 0x00010000)
+            await client.write_list({32: {0x00001234: 1, 0x00001238: 2}})
+            await client.close()
+
+        asyncio.run(run())
+        self.assertEqual(self.server.memory[0x00001238], 2)
+        self.assertIn('write_memory 0x1234 32 {0x1 0x2}', self.server.commands)
+
+    def test_watchpoint(self):
+        async def run():
+            client = await AsyncRegiceOpenOCD.connect('localhost',
+                                                      self.server.port)
+            hits = await client.watchpoint(0x00001234, 4, Watchpoint.RW)
+            self.server.memory[DFSR] = DFSR_DWTTRAP
+            self.server.notify('halted')
+            pc_address = await asyncio.wait_for(hits.__anext__(), 1)
+            await client.close()
+            return pc_address
+
+        self.assertEqual(asyncio.run(run()), 0x100)
+        self.assertIn('wp 0x1234 4 a', self.server.commands)
+        self.assertEqual(self.server.commands[-1], 'resume')
+
+    def test_watchpoint_no_dfsr(self):
+        async def run():
+            client = await AsyncRegiceOpenOCD.connect('localhost',
+                                                      self.server.port)
+            self.server.memory[DWT_CTRL] = 2 << 28
+            hits = await client.watchpoint(0x00001234, 4, Watchpoint.RW)
+            self.server.errors.add(DFSR)
+            self.server.notify('halted')
+            pc_address = await asyncio.wait_for(hits.__anext__(), 1)
+            await client.close()
+            return pc_address
+
+        self.assertEqual(asyncio.run(run()), 0x100)
+        self.assertEqual(self.server.commands[-1], 'resume')
+
+    def test_watchpoint_error(self):
+        async def run():
+            client = await AsyncRegiceOpenOCD.connect('localhost',
+                                                      self.server.port)
+            hits = await client.watchpoint(0x00001234, 4, Watchpoint.RW)
+            self.server.errors.add('reg')
+            self.server.notify('halted')
+            with self.assertRaises(ValueError):
+                await asyncio.wait_for(hits.__anext__(), 1)
+            await client.close()
+
+        asyncio.run(run())
+        self.assertEqual(self.server.commands[-1], 'resume')
+
+class TestAsyncRegiceClientAdapter(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.svd = load_svd('test.svd')
+
+    def test_device(self):
+        client = RegiceClientTest()
+        dev = Device(self.svd, AsyncRegiceClientAdapter(client))
+
+        async def run():
+            self.assertEqual(await dev.TEST1.TESTA.aread(), 0x00100003)
+            await dev.TEST1.TESTA.A3.awrite(4)
+            self.assertEqual(await dev.TEST1.TESTA.A3.aread(), 4)
+            await dev.acache_prefetch(['TEST1'])
+            await dev.client.close()
+
+        asyncio.run(run())
+        self.assertEqual(client.memory[0x00001234], 0x00100004)
+        self.assertEqual(dev.TEST1.TESTB.cached_value, client.memory[0x00001238])
+
 class TestRegice(unittest.TestCase):
     @classmethod
     def setUpClass(self):
@@ -151,6 +644,55 @@ class TestRegice(unittest.TestCase):
         address = self.regice.get_address('TEST1', 'TESTB')
         self.assertEqual(address, 0x00001238)
 
+    def test_lookup(self):
+        address, width, offset, mask = self.regice.lookup('TEST1', 'TESTA')
+        self.assertEqual(address, 0x00001234)
+        self.assertEqual(width, 32)
+        self.assertEqual(offset, 0)
+        self.assertEqual(mask, 0xffffffff)
+
+        address, width, offset, mask = self.regice.lookup('TEST1', 'TESTA',
+                                                          'A3')
+        self.assertEqual(address, 0x00001234)
+        self.assertEqual((0x00100003 >> offset) & mask, 3)
+
+        with self.assertRaises(InvalidPeripheral):
+            self.regice.lookup('TEST3', 'TESTA')
+        with self.assertRaises(InvalidRegister):
+            self.regice.lookup('TEST1', 'TESTC')
+        with self.assertRaises(InvalidField):
+            self.regice.lookup('TEST1', 'TESTA', 'A4')
+
+    def test_get_register_name(self):
+        self.assertEqual(self.regice.get_register_name(0x00001238),
+                         'TEST1.TESTB')
+        self.assertEqual(self.regice.get_register_name(0x00001235), None)
+
+    def test_decode_fields(self):
+        values = array('L', [0x00100003, 0x00000004, 0x00100000])
+        fields = self.regice.decode_fields('TEST1', 'TESTA', values)
+        self.assertEqual(len(fields), 3)
+        self.assertEqual(list(fields['A2']), [1, 0, 1])
+        self.assertEqual(list(fields['A3']), [3, 4, 0])
+
+        with self.assertRaises(InvalidRegister):
+            self.regice.decode_fields('TEST1', 'TESTC', values)
+
+    def test_decode(self):
+        registers = self.regice.decode(0x00001238)
+        self.assertEqual(len(registers), 1)
+        self.assertEqual(registers[0][:2], ('TEST1', 'TESTB'))
+
+        registers = self.regice.decode(0x00001236)
+        self.assertEqual(registers[0][:2], ('TEST1', 'TESTA'))
+
+        registers = self.regice.decode(0x00001234, 8)
+        self.assertEqual([register[1] for register in registers],
+                         ['TESTA', 'TESTB'])
+        self.assertEqual(len(registers[0][2]), 3)
+
+        self.assertEqual(self.regice.decode(0x00001000, 4), [])
+
     def test_get_base_address(self):
         address = self.regice.get_base_address('TEST1')
         self.assertEqual(address, 0x00001234)
@@ -182,6 +724,28 @@ class TestRegiceObject(unittest.TestCase):
         self.assertTrue(hasattr(self.dev.TEST1.TESTA, 'A1'))
         self.assertTrue(hasattr(self.dev.TEST1.TESTA, 'A2'))
 
+    def test_lazy(self):
+        dev = Device(self.dev.svd, self.client)
+        self.assertNotIn('TEST1', dev.__dict__)
+        peripheral = dev.TEST1
+        self.assertIn('TEST1', dev.__dict__)
+        self.assertIs(dev.TEST1, peripheral)
+        self.assertNotIn('TESTA', peripheral.__dict__)
+        self.assertIs(peripheral.TESTA, peripheral.TESTA)
+        self.assertIs(peripheral.TESTA.A1, peripheral.TESTA.A1)
+        self.assertFalse(hasattr(dev, 'TEST3'))
+
+        self.assertEqual(peripheral.TESTA.__dict__, {})
+        self.assertEqual(peripheral.TESTA.A1.__dict__, {})
+
+        self.assertEqual(len(dev.get_peripherals()), 2)
+        self.assertEqual(len(peripheral.get_registers()), 2)
+        self.assertEqual(len(peripheral.TESTA.get_fields()), 3)
+
+    def test_register_decode_fields(self):
+        fields = self.dev.TEST1.TESTA.decode_fields([0x00100003, 0])
+        self.assertEqual(list(fields['A3']), [3, 0])
+
     def test_register_to_int(self):
         reg = self.dev.TEST1.TESTA
         address = reg.address()
@@ -330,6 +894,569 @@ class RegicePeripheralTest(unittest.TestCase):
         value = reg.read()
         self.assertEqual(value, self.memory[address])
 
+    def test_flush(self):
+        peripheral = self.dev.TEST1
+        address = peripheral.TESTA.address()
+
+        self.client.block_writes = 0
+        peripheral.cache_configure(peripheral.TESTA.WRITE)
+        peripheral.TESTA.write(1)
+        peripheral.TESTB.write(2)
+        self.assertNotEqual(self.memory[address], 1)
+        peripheral.flush()
+        peripheral.cache_configure(peripheral.TESTA.DISABLED)
+        self.assertEqual(self.memory[address], 1)
+        self.assertEqual(self.memory[address + 4], 2)
+        self.assertEqual(self.client.block_writes, 1)
+
+    def test_restore(self):
+        peripheral = self.dev.TEST1
+        address = peripheral.TESTA.address()
+
+        peripheral.restore({'TESTA': 5, 'TESTB': 6})
+        self.assertEqual(self.memory[address], 5)
+        self.assertEqual(self.memory[address + 4], 6)
+
+        with self.assertRaises(InvalidRegister):
+            peripheral.restore({'TESTC': 0})
+
+class DeviceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        file = open_svd_file('test.svd')
+        svd = SVDText(file.read())
+        svd.parse()
+        self.client = RegiceClientTest()
+        self.dev = Device(svd, self.client)
+        self.memory = self.client.memory
+
+    def setUp(self):
+        self.client.memory_restore()
+        self.dev.TEST1.TESTA.cached_value = None
+        self.dev.TEST1.TESTB.cached_value = None
+
+    def test_cache_prefetch(self):
+        self.dev.cache_prefetch()
+        self.assertEqual(self.dev.TEST1.TESTA.cached_value,
+                         self.memory[self.dev.TEST1.TESTA.address()])
+        self.assertEqual(self.dev.TEST1.TESTB.cached_value,
+                         self.memory[self.dev.TEST1.TESTB.address()])
+
+    def test_cache_prefetch_peripherals(self):
+        self.client.block_reads = 0
+        self.dev.cache_prefetch(['TEST1'])
+        self.assertNotEqual(self.dev.TEST1.TESTA.cached_value, None)
+        self.assertEqual(self.client.block_reads, 1)
+
+        with self.assertRaises(InvalidPeripheral):
+            self.dev.cache_prefetch(['TEST3'])
+
+    def test_decode(self):
+        registers = self.dev.decode(0x00001234)
+        self.assertEqual(len(registers), 1)
+        register, fields = registers[0]
+        self.assertIs(register, self.dev.TEST1.TESTA)
+        self.assertIn(self.dev.TEST1.TESTA.A3, fields)
+
+    def test_snapshot(self):
+        before = self.dev.snapshot()
+        self.assertIn('TEST1.TESTA', before)
+        self.assertEqual(before['TEST1.TESTA'],
+                         self.memory[self.dev.TEST1.TESTA.address()])
+        self.assertEqual(list(before.addresses), sorted(before.addresses))
+
+        self.memory[self.dev.TEST1.TESTA.address()] = 0x00100004
+        after = self.dev.snapshot(['TEST1'])
+        changes = before.diff(after)
+        self.assertEqual(len(changes), 1 + len(before) - len(after))
+        self.assertEqual(changes[0].register, 'TEST1.TESTA')
+        self.assertEqual(changes[0].fields, {'A3': (3, 4)})
+
+        self.dev.restore(before)
+        self.assertEqual(self.memory[self.dev.TEST1.TESTA.address()],
+                         0x00100003)
+
+    def test_snapshot_save(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'test.snapshot')
+            snapshot = self.dev.snapshot()
+            snapshot.save(path)
+            loaded = Snapshot.load(path, self.dev.svd)
+            self.assertEqual(loaded.names, snapshot.names)
+            self.assertEqual(loaded.values, snapshot.values)
+            self.assertEqual(loaded.digest, snapshot.digest)
+            self.assertEqual(snapshot.diff(loaded), [])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_transaction(self):
+        reg = self.dev.TEST1.TESTA
+        address = reg.address()
+        expected = self.memory[address]
+
+        with self.dev.transaction():
+            reg.A2.write(0)
+            reg.A3.write(0)
+            self.assertEqual(self.memory[address], expected)
+            self.assertEqual(reg.A3, 0)
+        self.assertEqual(self.memory[address], 0)
+        self.assertEqual(reg.cache_flags, reg.DISABLED)
+
+    def test_user_attributes(self):
+        dev = Device(self.dev.svd, self.client)
+        dev.TEST1.TESTA.note = 'register'
+        dev.TEST1.TESTA.A1.note = 'field'
+        self.assertEqual(dev.TEST1.TESTA.note, 'register')
+        self.assertEqual(dev.TEST1.TESTA.A1.note, 'field')
+
+    def test_name_collision(self):
+        register = ('flush', 0, 32, None, (('read', 0, 4, None),))
+        svd = SVDCacheDevice(('COLLIDE', (
+            ('restore', 0x00001234, (register,)),
+            ('svd', 0x00001238, (('svd', 0, 32, None, ()),)),
+        )))
+        dev = Device(svd, self.client)
+        self.assertIsInstance(dev.restore, RegicePeripheral)
+        self.assertIsInstance(dev.restore.flush, RegiceRegister)
+        self.assertIs(dev.get_peripheral('restore'), dev.restore)
+        self.assertIs(dev.svd, svd)
+        peripheral = dev.get_peripheral('svd')
+        self.assertEqual(peripheral.get_register('svd').svd.name, 'svd')
+        field = dev.restore.flush.get_field('read')
+        self.assertEqual(field.read(), 0x3)
+        with self.assertRaises(InvalidPeripheral):
+            dev.get_peripheral('TEST1')
+        with self.assertRaises(InvalidRegister):
+            peripheral.get_register('TESTA')
+
+    def test_transaction_lazy(self):
+        dev = Device(self.dev.svd, self.client)
+        address = dev.svd.peripherals['TEST1'].registers['TESTA'].address()
+
+        with dev.transaction():
+            dev.TEST1.TESTA.write(0)
+            self.assertNotEqual(self.memory[address], 0)
+        self.assertEqual(self.memory[address], 0)
+        self.assertEqual(dev.TEST1.TESTA.cache_flags, RegiceRegister.DISABLED)
+        self.assertEqual(dev.TEST1.get_created_registers(), [dev.TEST1.TESTA])
+
+    def test_transaction_exception(self):
+        reg = self.dev.TEST1.TESTA
+        address = reg.address()
+        expected = self.memory[address]
+
+        with self.assertRaises(ValueError):
+            with self.dev.TEST1.transaction():
+                reg.write(0)
+                raise ValueError
+        self.assertEqual(self.memory[address], expected)
+        self.assertEqual(reg, expected)
+
+class TestSVDCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.svd')
+        with open(self.path, 'wb') as file:
+            data = open_svd_file('test.svd').read()
+            file.write(data if isinstance(data, bytes) else data.encode())
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_serialize(self):
+        svd = SVDCacheDevice(svd_serialize(load_svd('test.svd')))
+        self.assertIn('TEST1', svd.peripherals)
+        register = svd.peripherals['TEST1'].registers['TESTB']
+        self.assertEqual(register.address(), 0x00001238)
+
+        dev = Device(svd, RegiceClientTest())
+        self.assertEqual(dev.TEST1.TESTA.address(), 0x00001234)
+        self.assertTrue(dev.TEST1.TESTA.A3 == 3)
+        self.assertEqual(str(dev.TEST1.TESTA.A3), 'TEST1.TESTA.A3')
+
+    def test_load_svd_cached(self):
+        svd = load_svd_cached(self.path, self.cache_dir)
+        self.assertIsInstance(svd, SVDCacheDevice)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        with open(os.path.join(self.cache_dir,
+                               os.listdir(self.cache_dir)[0])) as file:
+            self.assertEqual(file.read(1), '[')
+
+        svd = load_svd_cached(self.path, self.cache_dir)
+        self.assertIsInstance(svd, SVDCacheDevice)
+        self.assertIn('TEST2', svd.peripherals)
+
+class TestTrace(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.svd = load_svd('test.svd')
+        self.client = RegiceClientTest()
+        self.dev = Device(self.svd, self.client)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.trace')
+        self.registers = [self.dev.TEST1.TESTA, self.dev.TEST1.TESTB]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_svd_hash(self):
+        svd = SVDCacheDevice(svd_serialize(self.svd))
+        self.assertEqual(svd_hash(svd), svd_hash(self.svd))
+
+    def test_write_read(self):
+        with TraceWriter(self.path, self.svd, self.registers) as writer:
+            writer.append(1.0, 0x00001234, 3)
+            writer.append_sample(2.0, {0x00001234: 4, 0x00001238: 5})
+
+        with TraceWriter(self.path, self.svd, self.registers) as writer:
+            writer.append(3.0, 0x00001238, 6)
+
+        with TraceReader(self.path) as reader:
+            self.assertEqual(reader.digest, svd_hash(self.svd))
+            self.assertEqual(reader.registers[1],
+                             ('TEST1.TESTB', 0x00001238, 32))
+            self.assertEqual(len(reader), 4)
+            self.assertEqual(list(reader.timestamps), [1.0, 2.0, 2.0, 3.0])
+            self.assertEqual(list(reader.ids), [0, 0, 1, 1])
+            self.assertEqual(list(reader.values), [3, 4, 5, 6])
+            timestamps, values = reader.get_register('TEST1.TESTB')
+            self.assertEqual(list(timestamps), [2.0, 3.0])
+            self.assertEqual(list(values), [5, 6])
+
+    def test_invalid(self):
+        with TraceWriter(self.path, self.svd, self.registers) as writer:
+            writer.append(1.0, 0x00001234, 3)
+        with self.assertRaises(InvalidTrace):
+            TraceWriter(self.path, self.svd, self.registers[:1])
+
+        with open(self.path, 'wb') as file:
+            file.write(b'not a trace file at all, not even close')
+        with self.assertRaises(InvalidTrace):
+            TraceReader(self.path)
+
+class TestRegiceClientRecorder(unittest.TestCase):
+    def setUp(self):
+        self.client = RegiceClientTest()
+        self.recorder = RegiceClientRecorder(self.client)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.rec')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_record(self):
+        self.assertEqual(self.recorder.read(32, 0x00001234), 0x00100003)
+        self.recorder.write(32, 0x00001234, 4)
+        values = self.recorder.read_list({32: [0x00001234, 0x00001238]})
+        self.assertEqual(values[0x00001234], 4)
+
+        recording = self.recorder.recording
+        self.assertEqual(len(recording), 4)
+        self.assertEqual(list(recording.accesses), [0, 1, 0, 0])
+        self.assertEqual(list(recording.values)[:2], [0x00100003, 4])
+
+    def test_forward(self):
+        closed = []
+        self.client.close = lambda: closed.append(True)
+        self.assertIs(self.recorder.memory, self.client.memory)
+        self.recorder.close()
+        self.assertEqual(closed, [True])
+
+    def test_replay(self):
+        self.recorder.read(32, 0x00001234)
+        self.recorder.write(32, 0x00001234, 4)
+        self.recorder.read_list({32: [0x00001234, 0x00001238]})
+        self.recorder.save(self.path)
+
+        replay = RegiceClientReplay(self.path)
+        self.assertEqual(replay.read(32, 0x00001234), 0x00100003)
+        values = replay.read_list({32: [0x00001234, 0x00001238]})
+        self.assertEqual(values[0x00001234], 4)
+        self.assertEqual(values[0x00001238], self.client.memory[0x00001238])
+        self.assertEqual(replay.read(32, 0x00001234), 4)
+        with self.assertRaises(KeyError):
+            replay.read(32, 0x00001240)
+
+        replay.write(32, 0x00001234, 5)
+        self.assertEqual(list(replay.writes.values), [5])
+
+    def test_replay_realtime(self):
+        recording = self.recorder.recording
+        recording.append(10.0, 0, 32, 0x00001234, 1)
+        recording.append(10.1, 0, 32, 0x00001234, 2)
+
+        replay = RegiceClientReplay(recording, realtime=True)
+        start = time()
+        self.assertEqual(replay.read(32, 0x00001234), 1)
+        self.assertEqual(replay.read(32, 0x00001234), 2)
+        self.assertGreaterEqual(time() - start, 0.09)
+
+class TestRegiceServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.svd = load_svd('test.svd')
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'regice.sock')
+        self.client = RegiceClientTest()
+        self.server = RegiceServer(self.client, self.path)
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_remote_client(self):
+        self.server.start()
+        remote = RegiceRemoteClient(self.path)
+        try:
+            self.assertEqual(remote.read(32, 0x00001234), 0x00100003)
+            remote.write(32, 0x00001234, 4)
+            self.assertEqual(self.client.memory[0x00001234], 4)
+
+            dev = Device(self.svd, remote)
+            dev.cache_prefetch()
+            self.assertEqual(dev.TEST1.TESTA.cached_value, 4)
+            self.assertEqual(dev.TEST1.TESTB.cached_value,
+                             self.client.memory[0x00001238])
+
+            with self.assertRaises(RegiceRemoteError):
+                remote.request(0, b'')
+        finally:
+            remote.close()
+
+    def request(self, connection, request_id, addresses):
+        payload = b''.join([READ_ENTRY.pack(32, address)
+                            for address in addresses])
+        connection.receive(REQUEST_HEADER.pack(len(payload), request_id,
+                                               OP_READ) + payload)
+
+    def response(self, sock):
+        length, request_id, status = RESPONSE_HEADER.unpack(
+            sock.recv(RESPONSE_HEADER.size))
+        payload = sock.recv(length)
+        if status != STATUS_OK:
+            return request_id, None
+        return request_id, list(unpack_values(payload))
+
+    def test_batch(self):
+        socks = [socket.socketpair() for i in range(2)]
+        connections = [RegiceServerConnection(sock[0]) for sock in socks]
+        self.server.connections += connections
+        self.request(connections[0], 1, [0x00001234])
+        self.request(connections[0], 2, [0x00001238])
+        self.request(connections[1], 1, [0x00001234, 0x00001238])
+
+        batch = self.server.next_batch()
+        self.assertEqual(len(batch), 2)
+        self.client.block_reads = 0
+        self.server.execute_batch(batch)
+        self.assertEqual(self.client.block_reads, 1)
+        self.assertEqual(self.response(socks[0][1]), (1, [0x00100003]))
+        self.assertEqual(self.response(socks[1][1]),
+                         (1, [0x00100003, self.client.memory[0x00001238]]))
+
+        batch = self.server.next_batch()
+        self.assertEqual(len(batch), 1)
+        self.assertEqual(batch[0][1], 2)
+        for sock in socks:
+            sock[0].close()
+            sock[1].close()
+
+    def test_batch_error(self):
+        socks = [socket.socketpair() for i in range(3)]
+        connections = [RegiceServerConnection(sock[0]) for sock in socks]
+        self.server.connections += connections
+        self.request(connections[0], 1, [0x00001234])
+        self.request(connections[1], 1, [0x00001234, 0xdead0000])
+        payload = WRITE_ENTRY.pack(32, 0x00001238, 5)
+        connections[2].receive(REQUEST_HEADER.pack(len(payload), 1,
+                                                   OP_WRITE) + payload)
+
+        read_list = self.client.read_list
+        def failing_read_list(addresses):
+            if 0xdead0000 in addresses[32]:
+                raise ValueError("Invalid address")
+            return read_list(addresses)
+        self.client.read_list = failing_read_list
+        self.client.block_writes = 0
+        self.server.execute_batch(self.server.next_batch())
+        self.assertEqual(self.client.block_writes, 1)
+        self.assertEqual(self.client.memory[0x00001238], 5)
+        self.assertEqual(self.response(socks[2][1]), (1, []))
+        self.assertEqual(self.response(socks[0][1]), (1, [0x00100003]))
+        self.assertEqual(self.response(socks[1][1]), (1, None))
+        for sock in socks:
+            sock[0].close()
+            sock[1].close()
+
+def fleet_cb(device, delay):
+    if device.client.memory[0x00001234] == 0:
+        raise ValueError("Invalid value")
+    if device.client.memory[0x00001234] == 1:
+        sleep(delay)
+    return device.TEST1.TESTA.read()
+
+def fleet_client(device):
+    return os.getpid(), id(device.client)
+
+class TestFleet(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.svd = SVDCacheDevice(svd_serialize(load_svd('test.svd')))
+
+    def test_thread(self):
+        clients = {name: RegiceClientTest() for name in ('a', 'b', 'c', 'd')}
+        clients['c'].memory[0x00001234] = 0
+        clients['d'].memory[0x00001234] = 1
+        fleet = Fleet(self.svd, clients)
+
+        results = fleet.run(fleet_cb, 0.5, timeout=0.2)
+        self.assertEqual(results, {'a': 0x00100003, 'b': 0x00100003})
+        self.assertIsInstance(results.errors['c'], ValueError)
+        self.assertIsInstance(results.errors['d'], TimeoutError)
+        self.assertEqual(results.table()[0], ('a', 0x00100003, None))
+
+        results = fleet.read('TEST1', 'TESTB')
+        self.assertEqual(len(results), 3)
+        self.assertIsInstance(results.errors['d'], TimeoutError)
+
+        sleep(0.5)
+        results = fleet.read('TEST1', 'TESTB')
+        self.assertEqual(len(results), 4)
+        fleet.close()
+
+    def test_process(self):
+        fleet = Fleet(self.svd, {'a': RegiceClientTest,
+                                 'b': RegiceClientTest}, pool='process')
+        results = fleet.snapshot(['TEST1'])
+        self.assertEqual(results['a']['TEST1.TESTA'], 0x00100003)
+        self.assertEqual(results['a'].diff(results['b']), [])
+        self.assertIs(results['a'].svd, self.svd)
+
+        executors = list(fleet.executors)
+        results = fleet.read('TEST1', 'TESTA')
+        self.assertEqual(results, {'a': 0x00100003, 'b': 0x00100003})
+        self.assertEqual(fleet.executors, executors)
+        fleet.close()
+
+    def test_process_affinity(self):
+        targets = {name: RegiceClientTest for name in ('a', 'b', 'c', 'd')}
+        fleet = Fleet(self.svd, targets, pool='process', workers=2)
+        first = fleet.run(fleet_client)
+        for i in range(3):
+            self.assertEqual(fleet.run(fleet_client), first)
+        self.assertEqual(len(set(first.values())), 4)
+        self.assertEqual(len(set([pid for pid, client in first.values()])),
+                         2)
+        fleet.close()
+
+class TestRingBuffer(unittest.TestCase):
+    def test_append(self):
+        buf = RingBuffer(3, 2)
+        buf.append(1.0, [1, 2])
+        buf.append(2.0, [3, 4])
+        self.assertEqual(len(buf), 2)
+        self.assertEqual(list(buf.get_timestamps()), [1.0, 2.0])
+        self.assertEqual(list(buf.get_values(1)), [2, 4])
+
+        buf.append(3.0, [5, 6])
+        buf.append(4.0, [7, 8])
+        self.assertEqual(len(buf), 3)
+        self.assertEqual(buf.total, 4)
+        self.assertEqual(list(buf.get_timestamps()), [2.0, 3.0, 4.0])
+        self.assertEqual(list(buf.get_values(0)), [3, 5, 7])
+
+class TestRegisterSampler(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        file = open_svd_file('test.svd')
+        svd = SVDText(file.read())
+        svd.parse()
+        self.client = RegiceClientTest()
+        self.dev = Device(svd, self.client)
+        self.memory = self.client.memory
+
+    def setUp(self):
+        self.client.memory_restore()
+
+    def test_tick(self):
+        registers = [self.dev.TEST1.TESTB, self.dev.TEST1.TESTA]
+        sampler = RegisterSampler(self.client, registers, 100)
+        self.client.block_reads = 0
+        sampler.tick()
+        self.assertEqual(self.client.block_reads, 1)
+        self.assertEqual(sampler.buffer.get_values(0)[0],
+                         self.memory[self.dev.TEST1.TESTB.address()])
+        self.assertEqual(sampler.buffer.get_values(1)[0],
+                         self.memory[self.dev.TEST1.TESTA.address()])
+
+    def test_run(self):
+        sampler = RegisterSampler(self.client, [self.dev.TEST1.TESTA], 200)
+        sampler.start()
+        sleep(0.2)
+        sampler.join()
+        stats = sampler.stats()
+        self.assertGreater(stats['samples'], 10)
+        self.assertGreater(stats['rate'], 0)
+
+class TestDeltaMonitor(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        file = open_svd_file('test.svd')
+        svd = SVDText(file.read())
+        svd.parse()
+        self.client = RegiceClientTest()
+        self.dev = Device(svd, self.client)
+        self.memory = self.client.memory
+
+    def setUp(self):
+        self.client.memory_restore()
+
+    def test_poll(self):
+        registers = [self.dev.TEST1.TESTA, self.dev.TEST1.TESTB]
+        monitor = DeltaMonitor(self.client, registers)
+        changes = monitor.poll()
+        self.assertEqual(len(changes), 2)
+        self.assertEqual(changes[0].register, 'TEST1.TESTA')
+        self.assertEqual(changes[0].old, None)
+        self.assertEqual(changes[0].fields['A3'], (None, 3))
+
+        self.assertEqual(monitor.poll(), [])
+
+        self.memory[self.dev.TEST1.TESTA.address()] = 0x00100004
+        changes = monitor.poll()
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0].old, 0x00100003)
+        self.assertEqual(changes[0].new, 0x00100004)
+        self.assertEqual(changes[0].fields, {'A3': (3, 4)})
+
+    def test_poll_alias(self):
+        name, peripherals = svd_serialize(self.dev.svd)
+        alias = ('ALIAS',) + peripherals[0][1:]
+        dev = Device(SVDCacheDevice((name, peripherals + (alias,))),
+                     self.client)
+        monitor = DeltaMonitor(self.client, [dev.TEST1.TESTA,
+                                             dev.ALIAS.TESTA])
+        self.assertEqual(len(monitor.poll()), 2)
+
+        self.memory[dev.TEST1.TESTA.address()] = 0x00100004
+        changes = monitor.poll()
+        self.assertEqual([change.register for change in changes],
+                         ['TEST1.TESTA', 'ALIAS.TESTA'])
+
+    def test_write_changes(self):
+        monitor = DeltaMonitor(self.client, [self.dev.TEST1.TESTA])
+        file = StringIO()
+        write_changes(monitor.changes(count=2), file)
+        lines = file.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertIn('TEST1.TESTA - 0x100003', lines[0])
+        self.assertIn('A3=-->3', lines[0])
 
 class TestRegisterSimulation(unittest.TestCase):
     @classmethod
@@ -409,6 +1536,21 @@ class TestWatchpoint(unittest.TestCase):
         self.simu = RegisterSimulation(self.client, self.svd)
         self.simu.read(open_resource(None, 'BL123_clock.sim'))
         self.client.watchpoints = {}
+        self.client.dispatcher = None
+
+    def test_watchpoint_dispatch(self):
+        address = self.dev.CLOCK0.OSC0.address()
+        dispatcher = self.client.watchpoint_dispatch(2,
+                                                     context={32: [address]})
+        self.client.watchpoint(address, 32, Watchpoint.RW,
+                               watchpoint_context_cb, self)
+        self.client.enable_watchpoint(address)
+
+        self.simu.start()
+        dispatcher.wait()
+        self.assertEqual(self.value, 1)
+        self.assertIn(address, self.context)
+        dispatcher.join()
 
     def test_watchpoint(self):
         address = self.dev.CLOCK0.OSC0.address()
@@ -50,6 +50,9 @@ setup(
         'regice': [
                 'init_args = libregice.plugin:init_args',
                 'process_args = libregice.plugin:process_args',
+        ],
+        'console_scripts': [
+                'regice-server = libregice.regiceremote:main',
         ]
     },
 )